@@ -6,6 +6,8 @@ setup(
     package_data = {"shark": [
         'objects/*.py',
         'extensions/*.py',
+        'management/*.py',
+        'management/commands/*.py',
         'migrations/*.py',
         'tests/*.py',
         'vue/*.py',
@@ -1,8 +1,10 @@
 import json
+import re
 from inspect import ismethod
 
-from shark.base import Object
+from shark.base import Object, objectify
 from shark.dependancies import escape_html, escape_url
+from shark.settings import SharkSettings
 
 
 class ExtendedJSONEncoder(json.JSONEncoder):
@@ -19,6 +21,46 @@ def js_action(action, **kwargs):
     return 'do_action(\'' + escape_html(action) + '\', ' + escape_html(json_params) + ');return false;'
 
 
+def js_command(js):
+    """
+    :return: The command that runs javascript in the browser. The javascript is stored and loaded by the browser as a
+             script from the site with run-script, which works under a Content Security Policy that doesn't allow
+             eval. With SHARK_EVAL_JS it's sent along with run-js, which saves the extra request but needs
+             'unsafe-eval', so it's only used when a project opts in.
+    """
+    if SharkSettings.SHARK_EVAL_JS:
+        return ['run-js', js]
+
+    from shark.cache import store_script
+    from shark.handler import ScriptHandler
+    return ['run-script', str(ScriptHandler.url(store_script(js)))]
+
+
+def updates(*names):
+    """
+    Declares the kept variables of the page handler that an action updates. Only placeholders for those variables
+    are set up when the action runs, without it every kept variable gets one.
+
+        @updates('cart', 'total')
+        def add_to_cart(self, product_id):
+            self.cart.replace(...)
+    """
+    def decorator(function):
+        function.updates = names
+        return function
+
+    return decorator
+
+
+def background(function):
+    """
+    Runs the action in the background executor, see shark.jobs. The reply to the action is sent right away, and the
+    browser polls for the progress set with handler.progress() and for the result of the action.
+    """
+    function.background = True
+    return function
+
+
 class BaseAction:
     """
     In websites there are many places where actions happen, such as:
@@ -46,6 +88,13 @@ class BaseAction:
         """
         return ''
 
+    def commands(self, renderer):
+        """
+        The action as commands for apply_commands in base.js, in the reply to an action
+        """
+        js = self.js(renderer)
+        return [js_command(js)] if js else []
+
     def href(self, renderer):
         """
         Attribute to add to an HTML element that supports href. But for javascript actions we use onclick
@@ -87,6 +136,9 @@ class URL(BaseAction):
 
         return 'window.location.href="{}";'.format(self._url)
 
+    def commands(self, renderer):
+        return [['redirect', self._url]] if self._url else []
+
     def __repr__(self):
         return self._url
 
@@ -116,6 +168,9 @@ class Action(BaseAction):
     def js(self, renderer):
         return 'do_action("{}", {});'.format(self._action, json.dumps(self.kwargs))
 
+    def commands(self, renderer):
+        return [['action', self._action, self.kwargs]]
+
     def __repr__(self):
         return 'Action("{}")'.format(self._action)
 
@@ -128,12 +183,41 @@ class NoAction(BaseAction):
         return False
 
 
+# The javascript for the commands of JQ, for calls on an element without a selector
+COMMAND_JS = {
+    'show': '{}.show();',
+    'hide': '{}.hide();',
+    'fade-in': '{}.fadeIn(400);',
+    'fade-out': '{}.fadeOut(400);',
+    'animate': '{}.animate({});',
+    'set-attr': '{}.attr({}, {});',
+    'set-val': '{}.val({});',
+    'append': '{}.append({});'
+}
+
+# $("selector") or $('selector'), the javascript of an element that can be sent as a selector
+SELECTOR_JS = re.compile(r'^\$\((["\'])([^"\'\\]*)\1\)$')
+
+
 class JQ(BaseAction, Object):
-    def __init__(self, obj_js, obj=None):
-        self._js_pre = ''
-        self._js_post = ''
+    """
+    Builds jQuery calls on an element. Rendered in a page they are javascript, in the reply to an action they are
+    commands for apply_commands in base.js. The calls are sent as commands with the selector of the element, given or
+    read from javascript like $("#id"). Only calls on other javascript, and javascript added to the calls, are sent
+    as javascript, see js_command.
+    """
+    def __init__(self, obj_js, obj=None, selector=None):
+        # The javascript is built when it's rendered, from strings, actions and ('html', obj_js, content)
+        self._js_pre = []
+        self._js_post = []
+        self._commands_pre = []
+        self._commands_post = []
         self.obj_js = obj_js
         self.obj = obj
+        if selector is None:
+            match = SELECTOR_JS.match(obj_js)
+            selector = match.group(2) if match else None
+        self.selector = selector
         self._rendered_js = None
         self.init({})
 
@@ -149,12 +233,12 @@ class JQ(BaseAction, Object):
         if isinstance(other, JQ):
             other._js_pre = self._js_pre + other._js_pre
             other._js_post = self._js_post + other._js_post
+            other._commands_pre = self._commands_pre + other._commands_pre
+            other._commands_post = self._commands_post + other._commands_post
             return other
-        elif isinstance(other, BaseAction):
-            self._js_post += other.js
-            return self
-        elif isinstance(other, str):
-            self._js_post += other
+        elif isinstance(other, (BaseAction, str)):
+            self._js_post.append(other)
+            self._commands_post.append(('action', other))
             return self
         elif not other:
             return self
@@ -162,73 +246,127 @@ class JQ(BaseAction, Object):
             raise TypeError('Cannot concatenate JQ object {} with {}'.format(self, other.__class__.__name__))
 
     def __radd__(self, other):
-        if isinstance(other, BaseAction):
-            self._js_pre = other.js + self._js_pre
-            return self
-        elif isinstance(other, str):
-            self._js_pre = other + self._js_pre
+        if isinstance(other, (BaseAction, str)):
+            self._js_pre.insert(0, other)
+            self._commands_pre.insert(0, ('action', other))
             return self
         elif not other:
             return self
         else:
             raise TypeError('Cannot concatenate JQ object {} with {}'.format(self, other.__class__.__name__))
 
+    def _command(self, name, *args):
+        # The javascript of the element is kept for calls on an element without a selector
+        self._commands_pre.append((name, self.selector, self.obj_js) + args)
+
     def show(self):
-        self._js_pre += '{}.show();'.format(self.obj_js)
+        self._js_pre.append('{}.show();'.format(self.obj_js))
+        self._command('show')
         return self
 
     def hide(self):
-        self._js_pre += '{}.hide();'.format(self.obj_js)
+        self._js_pre.append('{}.hide();'.format(self.obj_js))
+        self._command('hide')
         return self
 
     def fadeIn(self):
-        self._js_pre += '{}.fadeIn(400, function(){{'.format(self.obj_js)
-        self._js_post += '});'
+        self._js_pre.append('{}.fadeIn(400, function(){{'.format(self.obj_js))
+        self._js_post.append('});')
+        self._command('fade-in')
         return self
 
     def fadeOut(self):
-        self._js_pre += '{}.fadeOut(400, function(){{'.format(self.obj_js)
-        self._js_post += '});'
+        self._js_pre.append('{}.fadeOut(400, function(){{'.format(self.obj_js))
+        self._js_post.append('});')
+        self._command('fade-out')
         return self
 
     def animate(self, **kwargs):
-        self._js_pre += '{}.animate({}, function(){{'.format(self.obj_js, json.dumps(kwargs))
-        self._js_post += '});'
+        self._js_pre.append('{}.animate({}, function(){{'.format(self.obj_js, json.dumps(kwargs)))
+        self._js_post.append('});')
+        self._command('animate', kwargs)
         return self
 
     def attr(self, attr, value):
-        self._js_pre += '{}.attr("{}", {});'.format(self.obj_js, attr, json.dumps(value))
+        self._js_pre.append('{}.attr("{}", {});'.format(self.obj_js, attr, json.dumps(value)))
+        self._command('set-attr', attr, value)
         return self
 
     def val(self, value):
-        self._js_pre += '{}.val({});'.format(self.obj_js, json.dumps(value))
+        self._js_pre.append('{}.val({});'.format(self.obj_js, json.dumps(value)))
+        self._command('set-val', value)
         return self
 
     def html(self, content):
-        variable = self.add_variable(content)
-        self._js_pre += '{}.html({});func_{}();'.format(self.obj_js, variable, variable)
+        content = objectify(content)
+        self._js_pre.append(('html', self.obj_js, content))
+        self._command('replace-html', content)
         return self
 
     def append_raw(self, content):
-        self._js_pre += '{}.append({});'.format(self.obj_js, json.dumps(content))
+        self._js_pre.append('{}.append({});'.format(self.obj_js, json.dumps(content)))
+        self._command('append', content)
         return self
 
     def replace_resource(self, resource):
-        id = "#resource-{}-{}".format(resource.resource.module, resource.name)
-        self._js_pre += '$("#{}").remove();'.format('id')
-        self._js_pre += '$("head").append("<link id=\'{}\' rel=\'stylesheet\' href=\'{}\' type=\'text/css\' />");'.format(id, resource.url)
+        id = 'resource-{}-{}'.format(resource.resource.module, resource.name)
+        self._js_pre.append('$("#{}").remove();'.format(id))
+        self._js_pre.append('$("head").append("<link id=\'{}\' rel=\'stylesheet\' href=\'{}\' type=\'text/css\' />");'.format(
+            id, resource.url))
+        self._commands_pre.append(('replace-resource', '#' + id, None, resource.url))
         return self
 
     def js(self, renderer):
         if self._rendered_js is None:
+            parts = []
+            for part in self._js_pre + self._js_post:
+                if isinstance(part, str):
+                    parts.append(part)
+                elif isinstance(part, BaseAction):
+                    parts.append(part.js(renderer))
+                else:
+                    # The html is put in a variable with a function that runs its javascript
+                    variable = self.add_variable(part[2])
+                    parts.append('{}.html({});func_{}();'.format(part[1], variable, variable))
             renderer.render_variables(self._variables)
-            self._rendered_js = self._js_pre + self._js_post
+            self._rendered_js = ''.join(parts)
 
         return self._rendered_js
 
+    def commands(self, renderer):
+        """
+        :return: The calls as a list of commands for apply_commands in base.js
+        """
+        commands = []
+        for command in self._commands_pre + self._commands_post:
+            name = command[0]
+            if name == 'action':
+                if isinstance(command[1], str):
+                    commands.append(js_command(command[1]))
+                else:
+                    commands.extend(command[1].commands(renderer))
+                continue
+
+            selector, obj_js, args = command[1], command[2], list(command[3:])
+            if name == 'replace-html':
+                html, js = renderer.render_string_and_js(args[0])
+                if selector is None:
+                    commands.append(js_command('{}.html({});'.format(obj_js, json.dumps(html)) + js))
+                    continue
+                commands.append(['replace-html', selector, html])
+                if js:
+                    commands.append(js_command(js))
+            elif selector is None:
+                # A call on other javascript than $("selector") can only be sent as javascript
+                commands.append(js_command(COMMAND_JS[name].format(obj_js, *[json.dumps(arg) for arg in args])))
+            else:
+                commands.append([name, selector] + args)
+
+        return commands
+
     def get_html(self, renderer):
         renderer.append_js(self.js(renderer))
 
 
 def jq_by_id(id):
-    return JQ('$("#{}")'.format(id))
+    return JQ('$("#{}")'.format(id), selector='#' + id)
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class SharkConfig(AppConfig):
     name = 'shark'
+
+    def ready(self):
+        from shark.cache import track_model
+        # Pages depend on these, changes made to them in any process have to invalidate those pages
+        track_model(self.get_model('StaticPage'))
+        track_model(self.get_model('EditableText'))
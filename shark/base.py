@@ -1,5 +1,6 @@
 import logging
-from collections import Iterable
+import threading
+from collections import Iterable, OrderedDict
 from inspect import isclass
 
 from shark.common import Default
@@ -7,65 +8,102 @@ from shark.dependancies import escape_url, escape_html
 
 
 class BaseParamConverter(object):
+    __slots__ = ()
+
     @classmethod
     def convert(cls, value, parent_object):
         return value
 
 
 class EnumerationMeta(type):
+    """
+    Collects the int attributes of an Enumeration, in the order they are defined and including those of base
+    Enumerations, when the class is created. Lookups only use the resulting dicts.
+    """
+    # Serializes changes to the members after class creation. The maps are replaced, never changed, so lookups
+    # don't need the lock.
+    _lock = threading.Lock()
+
+    @classmethod
+    def __prepare__(mcs, name, bases, **kwargs):
+        return OrderedDict()
+
+    def __new__(mcs, name, bases, namespace, **kwargs):
+        cls = super().__new__(mcs, name, bases, namespace, **kwargs)
+
+        members = OrderedDict()
+        for base in reversed(bases):
+            if isinstance(base, EnumerationMeta):
+                members.update(base._members)
+        for key, value in namespace.items():
+            if is_member(key, value):
+                members[key] = value
+
+        cls._set_members(members)
+        return cls
+
+    def __setattr__(cls, name, value):
+        # Adding or changing an int attribute after the class was created changes the members as well, except for
+        # attributes that already exist and aren't members, like those inherited from a class that isn't an
+        # Enumeration.
+        changes_members = name in cls._members or (is_member(name, value) and not hasattr(cls, name))
+        super().__setattr__(name, value)
+
+        if changes_members:
+            with EnumerationMeta._lock:
+                members = OrderedDict(cls._members)
+                if is_member(name, value):
+                    members[name] = value
+                else:
+                    members.pop(name, None)
+                cls._set_members(members)
+
+    def _set_members(cls, members):
+        value_map = {}
+        for name, value in members.items():
+            value_map.setdefault(value, name)
+
+        type.__setattr__(cls, '_members', members)
+        type.__setattr__(cls, '_value_map', value_map)
+        type.__setattr__(cls, '_str_map', dict(members))
+
     @property
     def value_map(cls):
-        if not cls._value_map:
-            obj = cls()
-            cls._value_map = {
-                obj.__getattribute__(name): name
-                for name in dir(cls)
-                if name not in dir(Enumeration) and isinstance(obj.__getattribute__(name), int)
-            }
-
         return cls._value_map
 
     @property
     def str_map(cls):
-        if not cls._str_map:
-            cls._str_map = {value: key for key, value in cls.value_map.items()}
-            obj = cls()
-            cls._str_map = {
-                name: obj.__getattribute__(name)
-                for name in dir(cls)
-                if name not in dir(Enumeration) and isinstance(obj.__getattribute__(name), int)
-                }
-    
         return cls._str_map
 
 
-class Enumeration(BaseParamConverter, metaclass=EnumerationMeta):
-    _value_map = None
-    _str_map = None
+def is_member(name, value):
+    return isinstance(value, int) and not (name.startswith('__') and name.endswith('__'))
+
 
+class Enumeration(BaseParamConverter, metaclass=EnumerationMeta):
     @classmethod
     def name(cls, value):
-        if value in cls.value_map:
-            return cls.value_map[value]
-        else:
+        try:
+            return cls._value_map[value]
+        except KeyError:
             raise ValueError()
 
     @classmethod
     def names(cls):
-        return cls.value_map.values()
+        return cls._value_map.values()
 
     @classmethod
     def from_str(cls, value):
-        if value in cls.str_map:
-            return cls.str_map[value]
-        else:
+        try:
+            return cls._str_map[value]
+        except KeyError:
             raise ValueError()
 
     @classmethod
     def convert(cls, value, parent_object):
         if value is None or isinstance(value, int):
             return value
-        elif str(value) in cls.str_map:
+        elif str(value) in cls._str_map:
             try:
                 value = cls.from_str(value)
                 if value is not None:
@@ -107,10 +145,138 @@ class StringParam(BaseParamConverter):
         return ''
 
 
+_id_scopes = threading.local()
+
+
+class IdScope(object):
+    """
+    Numbers the html ids of Objects and Renderers. Within the with block every class name is counted from 1, so the
+    same input always gets the same ids:
+
+        with IdScope():
+            ...
+
+    The ids start with the prefix. Give html that is added to a page rendered in another scope a prefix, so its ids
+    can't clash with the ids on the page. Outside of any scope the numbers are shared by the whole process.
+    """
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def next_id(self, name):
+        with self.lock:
+            number = self.counters.get(name, 0) + 1
+            self.counters[name] = number
+
+        return '{}{}_{}'.format(self.prefix, name, number)
+
+    def iterate(self, iterable):
+        """
+        Iterates in this scope, for generators that run after the with block has ended, like a streamed response.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def __enter__(self):
+        _id_scopes.__dict__.setdefault('stack', []).append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _id_scopes.stack.pop()
+
+
+_process_id_scope = IdScope()
+
+
+def current_id_scope():
+    stack = getattr(_id_scopes, 'stack', None)
+    return stack[-1] if stack else _process_id_scope
+
+
+def next_id(name):
+    """
+    :return: A new html id for name, unique in the current IdScope
+    """
+    return current_id_scope().next_id(name)
+
+
 class BaseObject(object):
     """
 
     """
+    __slots__ = ()
+
+
+class Param(object):
+    """
+    Declares a parameter of an Object in its parameters list:
+
+        class Link(Object):
+            parameters = [
+                Param('text', ObjectsParam, 'Text of the link', None),
+                Param('url', UrlParam, 'Where the link goes', '')
+            ]
+
+            def __init__(self, text=Default, url='', **kwargs):
+                self.init(kwargs)
+                self.set_parameters(text, url)
+
+    The values are converted just like with Object.param, but the declarations are compiled into a single function
+    once per class. The default is shared by all objects of the class, which is why the text above defaults to None
+    instead of Objects(): None gets converted into a new empty Objects for every link.
+    """
+    def __init__(self, name, converter, description='', default=None):
+        if not name.isidentifier():
+            raise ValueError('Parameter name {!r} is not a valid attribute name'.format(name))
+        if not (isclass(converter) and issubclass(converter, BaseParamConverter)):
+            raise TypeError('type should be derived from BaseParamConverter')
+
+        self.name = name
+        self.converter = converter
+        self.description = description
+        self.default = default
+
+
+def compile_parameters(parameters):
+    """
+    Generates the function that converts and sets the values of a list of Param on an object. Only the checks each
+    parameter needs end up in the code, and no loop or lookups are needed when it runs.
+    """
+    namespace = {'Default': Default, 'Value': Value}
+    arguments = ['self']
+    lines = []
+    for i, param in enumerate(parameters):
+        namespace['convert_{}'.format(i)] = param.converter.convert
+        namespace['default_{}'.format(i)] = param.default
+        arguments.append('value_{}=Default'.format(i))
+
+        if param.default is Default:
+            # Default stays Default, so the rendering code can detect whether or not the parameter was provided
+            default = 'Default'
+        elif isinstance(param.default, Value):
+            default = 'convert_{0}(default_{0}.as_param(), self)'.format(i)
+        else:
+            default = 'convert_{0}(default_{0}, self)'.format(i)
+
+        lines.extend([
+            '    if value_{} is Default:'.format(i),
+            '        self.{} = {}'.format(param.name, default),
+            '    elif isinstance(value_{}, Value):'.format(i),
+            '        self.{0} = convert_{1}(value_{1}.as_param(), self)'.format(param.name, i),
+            '    else:',
+            '        self.{0} = convert_{1}(value_{1}, self)'.format(param.name, i)
+        ])
+
+    code = 'def set_parameters({}):\n{}'.format(', '.join(arguments), '\n'.join(lines) or '    pass')
+    exec(code, namespace)
+    return namespace['set_parameters']
 
 
 class Object(BaseObject, BaseParamConverter):
@@ -119,8 +285,12 @@ class Object(BaseObject, BaseParamConverter):
     html, js, etc.
     """
 
-    # Every class derived from Object keeps a counter to create unique html ids for the objects
-    object_number = 0
+    # Objects are kept small, as pages can have many thousands of them. Subclasses that don't declare __slots__
+    # get a __dict__ as usual.
+    __slots__ = ('_id', '_parent', '_attribute_dict', '_variable_dict')
+
+    # List of Param, set by set_parameters in the order of the list
+    parameters = []
 
     # noinspection PyAttributeOutsideInit
     def init(self, kwargs):
@@ -131,10 +301,11 @@ class Object(BaseObject, BaseParamConverter):
         :return: None
         """
         self._id = kwargs.pop('id', None)
-        self._attributes = {}
         self._parent = None
 
-        self._variables = {}
+        # The attributes and variables dicts are only created when they are used
+        self._attribute_dict = None
+        self._variable_dict = None
 
         for key, value in kwargs.items():
             key = key.strip('_')
@@ -143,6 +314,26 @@ class Object(BaseObject, BaseParamConverter):
             else:
                 self._attributes[key] = value
 
+    @property
+    def _attributes(self):
+        if self._attribute_dict is None:
+            self._attribute_dict = {}
+        return self._attribute_dict
+
+    @_attributes.setter
+    def _attributes(self, value):
+        self._attribute_dict = value
+
+    @property
+    def _variables(self):
+        if self._variable_dict is None:
+            self._variable_dict = {}
+        return self._variable_dict
+
+    @_variables.setter
+    def _variables(self, value):
+        self._variable_dict = value
+
     def __str__(self):
         return '<{} - {}>'.format(self.__class__.__name__, self._id)
 
@@ -164,8 +355,7 @@ class Object(BaseObject, BaseParamConverter):
         :return: The created or existing html id
         """
         if not self._id:
-            self.__class__.object_number += 1
-            self._id = '%s_%s' % (self.__class__.__name__, self.__class__.object_number)
+            self._id = next_id(self.__class__.__name__)
 
         return self._id
 
@@ -203,12 +393,31 @@ class Object(BaseObject, BaseParamConverter):
         else:
             raise TypeError('type should be derived from BaseParamConverter')
 
+    @classmethod
+    def parameter_setter(cls):
+        """
+        :return: The function compiled from the parameters list of the class, created on first use
+        """
+        setter = cls.__dict__.get('_parameter_setter')
+        if setter is None:
+            setter = cls._parameter_setter = compile_parameters(cls.parameters)
+
+        return setter
+
+    def set_parameters(self, *values):
+        """
+        Converts the values of the parameters declared in the class' parameters list, in the same order, and sets
+        them as attributes of the object. Parameters without a value get their default.
+        """
+        setter = self.__class__.__dict__.get('_parameter_setter') or self.parameter_setter()
+        setter(self, *values)
+
     @property
     def base_attributes(self):
         output = []
         if self._id:
             output.append('id="{}"'.format(self.id))
-        for attr, value in self._attributes.items():
+        for attr, value in (self._attribute_dict or {}).items():
             output.append('{}="{}"'.format(attr, value))
 
         if output:
@@ -283,7 +492,7 @@ class Object(BaseObject, BaseParamConverter):
     @property
     def jq(self):
         from shark.actions import JQ
-        return JQ("$('#{}')".format(self.id), self)
+        return JQ("$('#{}')".format(self.id), self, '#' + self.id)
 
     @classmethod
     def example(cls):
@@ -291,6 +500,8 @@ class Object(BaseObject, BaseParamConverter):
 
 
 class Objects(list, BaseObject):
+    __slots__ = ('_parent',)
+
     def __init__(self, *args, **kwargs):
         super().__init__(**kwargs)
         self.append(*args)
@@ -303,10 +514,10 @@ class Objects(list, BaseObject):
 
     def get_html(self, html):
         if self._parent and isinstance(self._parent, Object):
-            html.parent_tree.insert(0, self._parent)
+            html.push_parent(self._parent)
             for web_object in self:
                 html.render('', web_object)
-            html.parent_tree.pop(0)
+            html.pop_parent()
         else:
             for web_object in self:
                 html.render('', web_object)
@@ -341,7 +552,7 @@ class PlaceholderWebObject(BaseObject):
     @property
     def jq(self):
         from shark.actions import JQ
-        jq = JQ("$('#{}')".format(self.id), self)
+        jq = JQ("$('#{}')".format(self.id), self, '#' + self.id)
         self.jqs.append(jq)
         return jq
 
@@ -362,9 +573,15 @@ class Text(Object):
     """
     Just plain text.
     """
+    __slots__ = ('text',)
+
+    parameters = [
+        Param('text', StringParam, 'The text')
+    ]
+
     def __init__(self, text='', **kwargs):
         self.init(kwargs)
-        self.text = self.param(text, StringParam, 'The text')
+        self.set_parameters(text)
 
     def get_html(self, html):
         html.append(self.text)
@@ -0,0 +1,558 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from importlib import import_module
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signing import Signer, BadSignature
+from django.db import connections
+from django.db.models.signals import post_save, post_delete
+from django.http import HttpResponse, StreamingHttpResponse, HttpResponseNotModified
+from django.utils.crypto import get_random_string
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils.translation import get_language
+
+from shark.base import Enumeration
+from shark.common import listify, RequestLocals
+from shark.settings import SharkSettings
+
+
+class CacheVary(Enumeration):
+    """
+    What a cached page is varied by. The page gets cached separately for every different value.
+    """
+    args = 1
+    user = 2
+    authenticated = 3
+    language = 4
+    query_string = 5
+    host = 6
+
+
+def make_key(prefix, *parts):
+    return prefix + hashlib.md5('|'.join([str(part) for part in parts]).encode('utf-8')).hexdigest()
+
+
+_local = threading.local()
+
+
+class track_dependencies(object):
+    """
+    Records the models and primary keys that are read while the with block runs:
+
+        with track_dependencies() as dependencies:
+            ...
+
+    dependencies is a set of (model label, pk) tuples, where pk is None if the result depends on the whole table.
+    Nested blocks add their dependencies to the outer block as well.
+    """
+    def __init__(self, dependencies=None):
+        self.dependencies = set() if dependencies is None else dependencies
+
+    def __enter__(self):
+        _local.__dict__.setdefault('dependencies', []).append(self.dependencies)
+        return self.dependencies
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        stack = _local.dependencies
+        stack.pop()
+        if stack:
+            stack[-1].update(self.dependencies)
+
+
+def add_dependency(model, pk=None):
+    """
+    Record that the output currently being rendered depends on a model instance, or on the whole table if pk is None.
+    """
+    track_model(model)
+    stack = getattr(_local, 'dependencies', None)
+    if stack:
+        stack[-1].add((model._meta.label_lower, None if pk is None else str(pk)))
+
+
+def add_dependencies(dependencies):
+    stack = getattr(_local, 'dependencies', None)
+    if stack:
+        stack[-1].update(dependencies)
+
+
+_tracked_models = set()
+
+
+def track_model(model):
+    """
+    Makes saving or deleting a record of the model invalidate what depends on it. Models are tracked as soon as
+    something depends on them. A process that changes records without having rendered anything that depends on their
+    model, like a management command, has to track the model itself.
+    """
+    if model in _tracked_models:
+        return
+
+    _tracked_models.add(model)
+    post_save.connect(model_changed, sender=model, dispatch_uid='shark_model_saved')
+    post_delete.connect(model_changed, sender=model, dispatch_uid='shark_model_deleted')
+
+
+def dependency_key(label, pk):
+    return make_key('shark:dep:', label, pk)
+
+
+def dependency_versions(dependencies):
+    """
+    Every dependency has a version counter in the cache, which invalidate increments.
+    :return: The current versions of the dependencies, to be stored with the cache entry that depends on them and
+             checked with versions_current when it's read
+    """
+    keys = [dependency_key(label, pk) for label, pk in dependencies]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # A counter that was evicted starts again at a value it didn't have before, so entries stored with the old
+        # value don't match it
+        start = int(time.time() * 1000000)
+        for key in missing:
+            cache.add(key, start, None)
+        found = cache.get_many(missing)
+        versions.update({key: found.get(key) for key in missing})
+    return versions
+
+
+def versions_current(versions, current=None):
+    """
+    :param current: The current versions, when they were read from the cache together with those of other entries
+    :return: Whether none of the dependencies changed since dependency_versions returned the versions
+    """
+    if not versions:
+        return True
+
+    if current is None:
+        current = cache.get_many(list(versions))
+    return all(version is not None and current.get(key) == version for key, version in versions.items())
+
+
+def invalidate(model, pk):
+    """
+    Makes the cached pages and fragments that depend on the model instance or on the model's table out of date.
+    """
+    label = model._meta.label_lower
+    for key in [dependency_key(label, str(pk)), dependency_key(label, None)]:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Not in the cache, so nothing that is stored depends on the current version
+            pass
+
+
+def model_changed(sender, instance, **kwargs):
+    invalidate(sender, instance.pk)
+
+
+def page_cache_key(name, cache_vary, request, args, kwargs):
+    parts = [name]
+    for vary in listify(cache_vary):
+        if vary == CacheVary.args:
+            parts.append(repr(args))
+            parts.append(repr(sorted(kwargs.items())))
+        elif vary == CacheVary.user:
+            parts.append(request.user.pk if request.user.is_authenticated() else '')
+        elif vary == CacheVary.authenticated:
+            parts.append(request.user.is_authenticated())
+        elif vary == CacheVary.language:
+            parts.append(get_language())
+        elif vary == CacheVary.query_string:
+            parts.append(sorted(request.GET.lists()))
+        elif vary == CacheVary.host:
+            parts.append(request.get_host())
+
+    return make_key('shark:page:', *parts)
+
+
+# Seconds a worker may take to render a page before others stop waiting for it
+RENDER_LOCK_TIMEOUT = 30
+
+# Seconds a worker waits for a page another worker is rendering, before rendering it as well
+RENDER_WAIT_TIMEOUT = 2
+
+_flights_lock = threading.Lock()
+_flights = {}
+
+# When the state of each cached page was last stored by this process
+_kept_states = {}
+KEPT_STATES_SIZE = 10000
+
+
+def keep_page_state(state, token):
+    """
+    Keeps the state of a cached page stored while the page is served, as its clients post its token. It's only
+    written when it's missing, or when this process last stored it more than half of SHARK_PAGE_STATE_TIMEOUT ago.
+    """
+    if time.time() - _kept_states.get(token, 0) > SharkSettings.SHARK_PAGE_STATE_TIMEOUT / 2:
+        store_page_state(state, token)
+        state_kept(token)
+    else:
+        cache.add(page_state_key(token), state, SharkSettings.SHARK_PAGE_STATE_TIMEOUT)
+
+
+def state_kept(token):
+    if len(_kept_states) >= KEPT_STATES_SIZE:
+        _kept_states.clear()
+    _kept_states[token] = time.time()
+
+
+def page_response(page):
+    if page.get('state') and page['state'][1]:
+        keep_page_state(*page['state'])
+    response = HttpResponse(page['content'], status=page['status'])
+    for header, value in page['headers']:
+        response[header] = value
+    return response
+
+
+def get_cached_page(key):
+    """
+    :return: The page cached under key, or None if it's not in the cache or its dependencies changed
+    """
+    page = cache.get(key)
+    if page is None or not versions_current(page.get('versions')):
+        return None
+    return page
+
+
+def get_cached_response(key):
+    """
+    Returns a new response for the page cached under key, or None if it's not in the cache or expired.
+    """
+    page = get_cached_page(key)
+    if page is None or page['expires'] < time.time():
+        return None
+
+    return page_response(page)
+
+
+def cache_response(key, response, timeout, dependencies=(), stale_timeout=0, on_done=None):
+    """
+    Stores a successful response in the cache. Streaming responses are stored once all the content has been sent.
+    The cached response is removed when any of the dependencies change, and is kept stale_timeout seconds after
+    it expired to be served while it's rendered again.
+    :param on_done: Called when the response has been stored, or when it turns out it can't be stored
+    :return: The response to send to the client
+    """
+    if response.status_code != 200 or response.cookies:
+        if on_done:
+            on_done()
+        return response
+
+    headers = [(header, response[header]) for header in ['Content-Type', 'Content-Language', 'ETag', 'Last-Modified']
+               if response.has_header(header)]
+
+    def store(content):
+        page = {'content': content, 'status': 200, 'headers': headers, 'expires': time.time() + timeout,
+                'state': getattr(response, 'page_state', None), 'versions': dependency_versions(dependencies)}
+        cache.set(key, page, timeout + stale_timeout)
+        if page['state'] and page['state'][1]:
+            # Stored when the page was rendered
+            state_kept(page['state'][1])
+
+    if isinstance(response, StreamingHttpResponse):
+        def store_when_sent(streaming_content):
+            content = []
+            try:
+                # The page is rendered while it's being sent, so that's when the dependencies get recorded
+                with track_dependencies(dependencies):
+                    for chunk in streaming_content:
+                        content.append(chunk)
+                        yield chunk
+                store(b''.join(content))
+            finally:
+                if on_done:
+                    on_done()
+
+        response.streaming_content = store_when_sent(response.streaming_content)
+    else:
+        try:
+            store(response.content)
+        finally:
+            if on_done:
+                on_done()
+
+    return response
+
+
+def cached_page(key, render, timeout, stale_timeout=0):
+    """
+    Returns the response for the page cached under key, or calls render to create it.
+
+    Only one worker renders a page at a time. Other threads and processes that need the same page wait up to
+    RENDER_WAIT_TIMEOUT seconds for that result, and render the page themselves if it takes longer. With a stale_timeout, an expired page keeps being served for up to that
+    many seconds while it's rendered again in a background thread.
+    :param render: Function without arguments that returns the response
+    """
+    page = get_cached_page(key)
+    if page is not None:
+        if page['expires'] >= time.time():
+            return page_response(page)
+        if stale_timeout:
+            if cache.add(key + ':lock', 1, RENDER_LOCK_TIMEOUT):
+                threading.Thread(target=refresh_page, args=(key, render, timeout, stale_timeout, RequestLocals()),
+                                 daemon=True).start()
+            return page_response(page)
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = threading.Event()
+
+    if not leader:
+        # Another thread in this process is getting the page
+        flight.wait(RENDER_WAIT_TIMEOUT)
+        response = get_cached_response(key)
+        return response if response is not None else render()
+
+    def land():
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.set()
+
+    if cache.add(key + ':lock', 1, RENDER_LOCK_TIMEOUT):
+        def done():
+            cache.delete(key + ':lock')
+            land()
+
+        try:
+            with track_dependencies() as dependencies:
+                response = render()
+        except Exception:
+            done()
+            raise
+        return cache_response(key, response, timeout, dependencies, stale_timeout, done)
+
+    # Another process is rendering the page, wait a little for it to show up in the cache
+    try:
+        deadline = time.time() + RENDER_WAIT_TIMEOUT
+        while time.time() < deadline:
+            response = get_cached_response(key)
+            if response is not None:
+                return response
+            if not cache.get(key + ':lock'):
+                break
+            time.sleep(0.05)
+    finally:
+        land()
+
+    return render()
+
+
+def refresh_page(key, render, timeout, stale_timeout, request_locals):
+    """
+    Renders an expired page again after the request that served it stale has been answered, with the language,
+    urlconf and script prefix of that request.
+    """
+    try:
+        with request_locals, track_dependencies() as dependencies:
+            response = render()
+            response = cache_response(key, response, timeout, dependencies, stale_timeout,
+                                      lambda: cache.delete(key + ':lock'))
+            if isinstance(response, StreamingHttpResponse):
+                for chunk in response.streaming_content:
+                    pass
+    except Exception:
+        logging.exception('Refreshing cached page failed')
+        cache.delete(key + ':lock')
+    finally:
+        connections.close_all()
+
+
+def page_state_key(token):
+    return 'shark:state:' + token
+
+
+def make_page_token(value=None):
+    """
+    :return: A page token signed with the secret key, for the value or for a random one
+    """
+    return Signer(salt='shark.page').sign(value or get_random_string(12))
+
+
+def store_page_state(state, token=None):
+    """
+    Stores the state of a rendered page, for the actions posted from it, for SHARK_PAGE_STATE_TIMEOUT seconds.
+    :return: The signed page token the state is stored under
+    """
+    if token is None:
+        token = make_page_token()
+    cache.set(page_state_key(token), state, SharkSettings.SHARK_PAGE_STATE_TIMEOUT)
+    return token
+
+
+def validated_state_key(key):
+    return key + ':state'
+
+
+def remember_page_state(key, page_state):
+    """
+    Remembers the state of a page that clients revalidate with its ETag or Last-Modified date, under the page's
+    cache key, so refresh_page_state can keep it stored while the clients use their copy of the page.
+    :param page_state: The state and the page token it's stored under
+    """
+    cache.set(validated_state_key(key), page_state, SharkSettings.SHARK_PAGE_STATE_TIMEOUT)
+
+
+def refresh_page_state(key):
+    """
+    Stores the state remembered for the page again, when a client's copy of the page is still valid.
+    """
+    page_state = cache.get(validated_state_key(key))
+    if page_state:
+        store_page_state(*page_state)
+        remember_page_state(key, page_state)
+
+
+def valid_page_token(token):
+    try:
+        Signer(salt='shark.page').unsign(token)
+    except BadSignature:
+        return False
+    return True
+
+
+def load_page_state(token):
+    """
+    :return: The state stored for a page token, or None if the token isn't valid or the state has expired
+    """
+    if not valid_page_token(token):
+        return None
+
+    return cache.get(page_state_key(token))
+
+
+# Files that change what the pages look like, when they're in an app or template directory
+CODE_EXTENSIONS = ('.py', '.html', '.txt', '.xml', '.md')
+
+_code_version = None
+
+
+def code_version():
+    """
+    :return: SHARK_CODE_VERSION, or a hash of the names, sizes and modification times of the python files and
+             templates of the installed apps, the template directories, the package with the urlconf and the
+             manifest of the static files. It changes when the code, the templates or the static file names may
+             have changed, and is computed once per process.
+    """
+    global _code_version
+    if SharkSettings.SHARK_CODE_VERSION:
+        return SharkSettings.SHARK_CODE_VERSION
+    if _code_version is not None:
+        return _code_version
+
+    paths = [app_config.path for app_config in apps.get_app_configs()]
+    for engine in settings.TEMPLATES:
+        paths.extend(engine.get('DIRS', []))
+    paths.append(os.path.dirname(import_module(settings.ROOT_URLCONF).__file__))
+
+    files = hashlib.md5()
+    for path in sorted(set(paths)):
+        for directory, directories, names in os.walk(path):
+            directories[:] = sorted(name for name in directories if name not in ('__pycache__', 'static'))
+            for name in sorted(names):
+                if name.endswith(CODE_EXTENSIONS):
+                    add_file(files, os.path.join(directory, name))
+    static_manifest = os.path.join(settings.STATIC_ROOT or '', 'staticfiles.json')
+    if settings.STATIC_ROOT and os.path.exists(static_manifest):
+        add_file(files, static_manifest)
+
+    _code_version = files.hexdigest()
+    return _code_version
+
+
+def add_file(files, path):
+    stat = os.stat(path)
+    files.update('{}|{}|{}\n'.format(path, stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+
+
+# Seconds the javascript sent with the run-script command can be loaded
+SCRIPT_TIMEOUT = 60 * 60
+
+
+def store_script(js):
+    """
+    Stores javascript to be loaded as a script by the browser, see shark.actions.js_command.
+    :return: The key of the script, which can't be derived from the javascript without the SECRET_KEY
+    """
+    key = make_key('', settings.SECRET_KEY, js)
+    cache.set('shark:script:' + key, js, SCRIPT_TIMEOUT)
+    return key
+
+
+def load_script(key):
+    return cache.get('shark:script:' + key)
+
+
+def make_etag(*parts):
+    """
+    :return: A strong ETag, quoted as it's used in the ETag header. It includes the code version, so clients get the
+             new page after a release even if the parts didn't change.
+    """
+    return '"{}"'.format(make_key('', code_version(), *parts))
+
+
+def content_etag(content):
+    return '"{}"'.format(hashlib.md5(content).hexdigest())
+
+
+def etag_matches(etag, if_none_match):
+    """
+    Compares an ETag to the value of an If-None-Match header, which uses the weak comparison.
+    """
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+
+def not_modified(request, etag=None, last_modified=None):
+    """
+    :param last_modified: Seconds since the epoch
+    :return: Whether the client's copy of the page is still valid. If-None-Match is used when the client sends it,
+             If-Modified-Since otherwise.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return etag is not None and etag_matches(etag, if_none_match)
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return last_modified is not None and if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+def add_validators(response, etag=None, last_modified=None):
+    """
+    Sets the ETag and Last-Modified headers, last_modified is in seconds since the epoch.
+    """
+    if etag is not None and not response.has_header('ETag'):
+        response['ETag'] = etag
+    if last_modified is not None and not response.has_header('Last-Modified'):
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def conditional_response(request, response):
+    """
+    Replaces a successful response by a 304 Not Modified if the client already has it, going by the response's ETag
+    and Last-Modified headers.
+    """
+    if response.status_code != 200:
+        return response
+
+    etag = response.get('ETag')
+    last_modified = parse_http_date_safe(response.get('Last-Modified', ''))
+    if not not_modified(request, etag, last_modified):
+        return response
+
+    if isinstance(response, StreamingHttpResponse):
+        response.close()
+    return add_validators(HttpResponseNotModified(), etag, last_modified)
@@ -1,5 +1,7 @@
 from collections import Iterable
+from django.core.urlresolvers import get_urlconf, set_urlconf, get_script_prefix, set_script_prefix
 from django.http import Http404
+from django.utils import translation
 
 Default = object()
 
@@ -42,6 +44,37 @@ def listify(obj):
         return [obj]
 
 
+class RequestLocals(object):
+    """
+    The thread-locals Django sets for a request: the active language, the urlconf and the script prefix. They are
+    taken when it's created, and set again in the with block, for work done for the request in another thread.
+    """
+    def __init__(self):
+        self.values = self.get()
+
+    @staticmethod
+    def get():
+        return translation.get_language(), get_urlconf(), get_script_prefix()
+
+    @staticmethod
+    def set(values):
+        language, urlconf, script_prefix = values
+        if language:
+            translation.activate(language)
+        else:
+            translation.deactivate_all()
+        set_urlconf(urlconf)
+        set_script_prefix(script_prefix)
+
+    def __enter__(self):
+        self.previous = self.get()
+        self.set(self.values)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.set(self.previous)
+
+
 def first_or_404(model, **kwargs):
     obj = model.objects.filter(**kwargs).first()
     if obj is None:
@@ -1,6 +1,9 @@
+import gzip
 import json
 import logging
+import uuid
 from collections import Iterable
+from time import perf_counter
 
 import bleach
 import pickle
@@ -8,13 +11,18 @@ import pickle
 import markdown
 from django.contrib.staticfiles.storage import staticfiles_storage
 from django.core import signing
+from django.core.cache import cache
 from django.core.exceptions import FieldDoesNotExist
-from django.core.urlresolvers import reverse, get_resolver, RegexURLResolver, RegexURLPattern, NoReverseMatch
-from django.http import Http404, HttpResponse, HttpResponseRedirect, HttpResponsePermanentRedirect
+from django.core.urlresolvers import reverse, get_resolver, RegexURLResolver, RegexURLPattern, NoReverseMatch, \
+    get_urlconf, get_script_prefix
+from django.http import Http404, HttpResponse, HttpResponseRedirect, HttpResponsePermanentRedirect, StreamingHttpResponse, \
+    HttpResponseNotModified
 from django.middleware.csrf import get_token
 from django.shortcuts import render
+from django.template.loader import render_to_string
 from django.test import Client
 from django.test import TestCase
+from django.utils.cache import patch_vary_headers
 from django.utils.html import escape
 from django.utils.http import urlquote
 from django.utils.timezone import now
@@ -22,9 +30,14 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.static import serve
 
 from shark import models
-from shark.actions import JS, JQ, URL, Action, BaseAction
+from shark.actions import JS, URL, Action, BaseAction, jq_by_id, js_command
+from shark.cache import CacheVary, page_cache_key, cached_page, make_etag, content_etag, not_modified, add_validators, \
+    conditional_response, store_page_state, load_page_state, make_page_token, make_key, track_dependencies, \
+    dependency_versions, versions_current, add_dependency, remember_page_state, refresh_page_state, load_script, \
+    SCRIPT_TIMEOUT
 from shark.common import listify
 from shark.extensions.markdown import Markdown, ALLOWED_TAGS, ALLOWED_ATTRIBUTES, ALLOWED_STYLES
+from shark.jobs import start_job, set_progress, job_commands, POLL_INTERVAL
 from shark.models import EditableText, StaticPage as StaticPageModel
 from shark.objects.analytics import GoogleAnalyticsTracking
 from shark.objects.base import Script
@@ -32,20 +45,57 @@ from shark.objects.layout import Div, Spacer, Row
 from shark.objects.navigation import NavLink
 from shark.objects.ui_elements import BreadCrumbs
 from shark.param_converters import ObjectsParam
+from shark.profiler import RenderProfiler, profile_phase, profile_generator, profile_hook
 from shark.renderer import Renderer
 from shark.settings import SharkSettings
-from .base import Objects, Object, PlaceholderWebObject
+from shark.shell import page_shell
+from .base import Objects, Object, PlaceholderWebObject, IdScope, current_id_scope
 from .resources import Resources
 
-unique_name_counter = 0
 
-class BaseHandler:
+# Urls reversed by BaseHandler.reverse, for the resolver they were reversed with
+_url_cache = {}
+_url_cache_resolver = None
+URL_CACHE_SIZE = 10000
+
+
+class HandlerMeta(type):
+    """
+    Registers every handler class under the module it's defined in, so shark.urls can find the handlers of an app
+    without looking through its views module.
+    """
+    handlers = {}
+
+    def __init__(cls, name, bases, namespace):
+        super().__init__(name, bases, namespace)
+        HandlerMeta.handlers.setdefault(cls.__module__, []).append(cls)
+
+    @classmethod
+    def module_handlers(mcs, module_name):
+        """
+        :return: The handlers defined in the module and its submodules, sorted by name
+        """
+        handlers = []
+        for module, module_handlers in mcs.handlers.items():
+            if module == module_name or module.startswith(module_name + '.'):
+                handlers.extend(module_handlers)
+        return sorted(handlers, key=lambda handler: handler.__name__)
+
+
+class BaseHandler(metaclass=HandlerMeta):
     route = None
     redirects = None
 
     def __init__(self, *args, **kwargs):
         pass
 
+    @classmethod
+    def handle(cls, request, *args, **kwargs):
+        # Every request numbers its html ids from 1, html sent in reply to a POST is added to a page that already
+        # has those ids so it gets a prefix.
+        with IdScope('' if request.method in ('GET', 'HEAD') else 'r{}_'.format(uuid.uuid4().hex[:8])):
+            return cls().render_base(request, *args, **kwargs)
+
     def render_base(self, request, *args, **kwargs):
         return self.render(request, *args, **kwargs)
 
@@ -55,16 +105,57 @@ class BaseHandler:
     unique_name = None
     @classmethod
     def get_unique_name(cls):
-        if not cls.unique_name:
-            global unique_name_counter
-            unique_name_counter += 1
-            cls.unique_name = '{}-{}'.format(cls.__name__, unique_name_counter)
+        # Based on where the class is defined, so it's the same in every process. Subclasses get their own name.
+        if not cls.__dict__.get('unique_name'):
+            cls.unique_name = '{}.{}'.format(cls.__module__, cls.__qualname__)
 
         return cls.unique_name
 
+    @classmethod
+    def route_name(cls):
+        return 'shark:' + cls.get_unique_name()
+
+    @classmethod
+    def reverse(cls, args=(), kwargs=None):
+        """
+        Django's reverse for this handler, cached per process. The cache is emptied when the urlconf is reloaded.
+        """
+        global _url_cache_resolver
+        urlconf = get_urlconf()
+        resolver = get_resolver(urlconf)
+        if resolver is not _url_cache_resolver:
+            _url_cache.clear()
+            _url_cache_resolver = resolver
+
+        # The types are part of the key, as 1 and True are equal but don't give the same url
+        key = (cls, args, tuple(map(type, args)),
+               tuple(sorted((name, value, type(value)) for name, value in kwargs.items())) if kwargs else (),
+               urlconf, get_script_prefix())
+        try:
+            url = _url_cache.get(key)
+        except TypeError:
+            # Arguments that can't be hashed aren't cached
+            return reverse(cls.route_name(), args=args, kwargs=kwargs, current_app='shark')
+
+        if url is None:
+            url = reverse(cls.route_name(), args=args, kwargs=kwargs, current_app='shark')
+            if len(_url_cache) >= URL_CACHE_SIZE:
+                _url_cache.clear()
+            _url_cache[key] = url
+        return url
+
     @classmethod
     def url(cls, *args, **kwargs):
-        return URL(reverse('shark:' + cls.get_unique_name(), args=args, kwargs=kwargs, current_app='shark'), False)
+        return URL(cls.reverse(args, kwargs), False)
+
+    @classmethod
+    def urls(cls, args_list):
+        """
+        :return: The urls of the handler for a list of arguments, like [[1, 'first'], [2, 'second']]. A single
+                 argument doesn't need to be in a list.
+        """
+        return [URL(cls.reverse(tuple(args) if isinstance(args, Iterable) and not isinstance(args, str) else (args,)),
+                    False) for args in args_list]
 
     @classmethod
     def sitemap(cls):
@@ -93,10 +184,69 @@ class NotFound404(Exception):
     pass
 
 
+def css_links(css_resources):
+    return '\r\n'.join([
+        '        <link rel="stylesheet" href="{}" id="resource-{}-{}"/>'.format(css_resource.url, css_resource.module, css_resource.name)
+        for css_resource in css_resources
+    ])
+
+
+def post_value(value):
+    """
+    :return: The value from a json list of actions as it would have been posted as a form field
+    """
+    if value is None:
+        return ''
+    elif isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+
+def commands_response(commands):
+    """
+    :return: The reply to an action, with the commands for apply_commands in base.js
+    """
+    return HttpResponse(json.dumps({'commands': commands}, separators=(',', ':')), content_type='application/json')
+
+
+def js_scripts(js_files):
+    return '\r\n'.join(['        <script src="{}"></script>'.format(js_file) for js_file in js_files])
+
+
 class BasePageHandler(BaseHandler):
     ignored_variables = ['items', 'modals', 'nav', 'container', 'base_object', 'current_user', 'user']
 
+    # Set to True to send the page as a StreamingHttpResponse while it is being rendered
+    streaming = False
+
+    # Seconds to cache the output of GET requests, None disables caching. The page is cached separately for every
+    # combination of the CacheVary values in cache_vary. Pages that don't read request.GET can leave out
+    # CacheVary.query_string, so links with tracking parameters share one cached copy.
+    cache_timeout = None
+    cache_vary = [CacheVary.args, CacheVary.user, CacheVary.query_string]
+    # Seconds an expired page is still served while it's rendered again in the background
+    cache_stale_timeout = 0
+
+    # Send an ETag with GET responses, and reply 304 Not Modified to clients that already have the page
+    etag = True
+
+    # Let the page receive updates sent with shark.push.PageChannel. Every open page keeps a request running, see
+    # PageChannel for what that means for the workers serving the site.
+    push = False
+
+    # Collect timings of the request in self.profiler, None uses the SHARK_PROFILER setting
+    profile = None
+
+    # Leave indentation and line breaks out of the rendered html, None uses the SHARK_MINIFY_HTML setting
+    minify = None
+
     def __init__(self, *args, **kwargs):
+        started = perf_counter()
+        # The Objects assigned to attributes of the handler, to be used again by actions. Subclasses can assign them
+        # before calling this.
+        self.__dict__.setdefault('_kept_variables', {})
         self.title = ''
         self.description = ''
         self.keywords = ''
@@ -115,16 +265,76 @@ class BasePageHandler(BaseHandler):
         self.footer = None
 
         self.javascript = ''
+        # Commands for apply_commands in base.js, sent in the reply to an action
+        self.commands = []
+        # Id of the job when running background actions
+        self.job_id = None
+        self.page_token = ''
 
         self.resources = Resources()
 
-        print('Handler created', self.__class__.__name__, now())
+        profile = SharkSettings.SHARK_PROFILER if self.profile is None else self.profile
+        self.profiler = RenderProfiler() if profile else None
+        if self.profiler:
+            self.profiler.add_phase('init', perf_counter() - started)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if isinstance(value, Object) and name not in self.ignored_variables:
+            self.__dict__.setdefault('_kept_variables', {})[name] = value
+        elif name in self.__dict__.get('_kept_variables', ()):
+            del self._kept_variables[name]
+
+    @classmethod
+    def handle(cls, request, *args, **kwargs):
+        if not cls.cache_timeout or request.method != 'GET':
+            response = super().handle(request, *args, **kwargs)
+        else:
+            get_token(request)
+            response = cached_page(
+                cls.get_cache_key(request, args, kwargs),
+                lambda: super(BasePageHandler, cls).handle(request, *args, **kwargs),
+                cls.cache_timeout,
+                cls.cache_stale_timeout
+            )
+
+        return conditional_response(request, response) if cls.etag else response
+
+    @classmethod
+    def get_cache_key(cls, request, args, kwargs):
+        return page_cache_key(cls.get_unique_name(), cls.cache_vary, request, args, kwargs)
 
     def init(self, request):
         pass
 
-    def output_html(self, args, kwargs):
-        print('Start output HTML', now())
+    def version_key(self, request, *args, **kwargs):
+        """
+        Override to return a str that changes whenever the page changes, for instance built from the modification
+        dates of the records on the page. It's called before render_page, and when the client has the same version
+        a 304 Not Modified is returned without rendering the page. Return None to use a hash of the rendered page.
+        """
+        return None
+
+    def last_modified(self, request, *args, **kwargs):
+        """
+        Override to return the datetime the page last changed, it's sent in the Last-Modified header.
+        """
+        return None
+
+    def get_validators(self, request, args, kwargs):
+        """
+        :return: The ETag from version_key and the Last-Modified time in seconds since the epoch, None if unknown
+        """
+        etag = None
+        if self.etag:
+            version = self.version_key(request, *args, **kwargs)
+            if version is not None:
+                etag = make_etag(self.get_cache_key(request, args, kwargs), version)
+
+        modified = self.last_modified(request, *args, **kwargs)
+        return etag, (int(modified.timestamp()) if modified else None)
+
+    def get_content(self):
         content = Objects()
         content.append(self.modals)
         content.append(self.nav)
@@ -134,52 +344,139 @@ class BasePageHandler(BaseHandler):
             self.base_object.insert(1, Row(Div(BreadCrumbs(*self.crumbs), classes='col-md-12')))
         content.append(self.items)
         content.append(self.footer)
+        return content
 
-        keep_variables = {}
-        for variable_name in dir(self):
-            if variable_name not in self.ignored_variables:
-                variable = self.__getattribute__(variable_name)
-                if isinstance(variable, Object):
-                    keep_variables[variable_name] = variable.serialize()
-
-        renderer = Renderer(self)
-        print('Start render', now())
-        renderer.render('        ', content)
-        print('End render', now(), renderer.render_count)
-
-        renderer.resources.add_resources(self.resources)
+    def get_keep_variables(self):
+        return {variable_name: variable.serialize() for variable_name, variable in self._kept_variables.items()}
 
+    def get_page_context(self, page_token):
         if not self.robots_follow:
             self.extra_meta += '\r\n        <meta name="robots" content="nofollow">'
         if not self.robots_index:
             self.extra_meta += '\r\n        <meta name="robots" content="noindex">'
 
-        html = render(self.request, 'shark/base.html', {
-                                  'title': self.title,
-                                  'description': self.description.replace('"', '\''),
-                                  'keywords': self.keywords,
-                                  'author': self.author,
-                                  'extra_meta': self.extra_meta,
-                                  'gtm_code': self.gtm_code,
-                                  'content': renderer.html,
-                                  'extra_css': '\r\n'.join(
-                                      [
-                                          '        <link rel="stylesheet" href="{}" id="resource-{}-{}"/>'.format(css_resource.url, css_resource.module, css_resource.name)
-                                          for css_resource in renderer.css_resources
-                                      ]
-                                  ),
-                                  'extra_js': '\r\n'.join(
-                                      ['        <script src="{}"></script>'.format(js_file)
-                                      for js_file in renderer.js_files]
-                                  ),
-                                  'javascript': renderer.js,
-                                  'css': renderer.css,
-                                  'keep_variables': keep_variables
-        })
+        return {
+            'title': self.title,
+            'description': self.description.replace('"', '\''),
+            'keywords': self.keywords,
+            'author': self.author,
+            'extra_meta': self.extra_meta,
+            'gtm_code': self.gtm_code,
+            'page_token': page_token,
+            'push_url': self.push_url() if self.push else ''
+        }
+
+    def push_url(self):
+        from shark.push import PushHandler
+        return PushHandler.url()
+
+    @property
+    def minify_html(self):
+        return SharkSettings.SHARK_MINIFY_HTML if self.minify is None else self.minify
+
+    @property
+    def show_profiler_panel(self):
+        return self.profiler is not None and SharkSettings.SHARK_PROFILER_PANEL and self.user.is_staff
+
+    def profiled(self):
+        """
+        Called after a profiled request has been rendered. Logs the timings in self.profiler and passes them to the
+        SHARK_PROFILER_HOOK function. Override to do something else with them.
+        """
+        self.profiler.log()
+        hook = profile_hook()
+        if hook:
+            hook(self, self.profiler)
+
+    def output_html(self, args, kwargs):
+        content = self.get_content()
+        keep_variables = self.get_keep_variables()
+        if self.push:
+            # Every view of the page gets its own token, for the updates pushed to it
+            page_token = store_page_state(keep_variables)
+        elif keep_variables:
+            # Pages with the same state share a token, so the page stays the same and so does its ETag
+            page_token = store_page_state(keep_variables, make_page_token(
+                make_key('', self.get_unique_name(), json.dumps(keep_variables, sort_keys=True))[:12]
+            ))
+        else:
+            page_token = ''
+        self.page_token = page_token
 
-        print('End output HTML', now())
-        return html
+        if self.streaming:
+            response = StreamingHttpResponse(current_id_scope().iterate(self.stream_html(content, page_token)))
+            response.page_state = (keep_variables, page_token)
+            return response
 
+        renderer = Renderer(self)
+        with profile_phase(self.profiler, 'render'):
+            renderer.render('        ', content)
+
+        renderer.resources.add_resources(self.resources)
+
+        html = renderer.html
+        if self.show_profiler_panel:
+            html += self.profiler.panel_html()
+
+        context = self.get_page_context(page_token)
+        context.update({
+            'content': html,
+            'extra_css': css_links(renderer.css_resources),
+            'extra_js': js_scripts(renderer.js_files),
+            'javascript': renderer.js,
+            'css': renderer.css
+        })
+        with profile_phase(self.profiler, 'template'):
+            shell = page_shell()
+            if shell:
+                response = HttpResponse(shell.page(context))
+            else:
+                response = render(self.request, 'shark/base.html', context)
+        # Stored with the page when it's cached, so it can be stored again while the page is served from the cache
+        response.page_state = (keep_variables, page_token)
+        return response
+
+    def stream_html(self, content, page_token):
+        """
+        Generator for the streaming version of the page. The head goes out first, followed by the html of the
+        content as it gets rendered. CSS and resources only found while rendering are added at the end of the body,
+        together with the javascript.
+        """
+        context = self.get_page_context(page_token)
+        shell = page_shell()
+        renderer = Renderer(self)
+        renderer.resources.add_resources(self.resources)
+        head_css_resources = renderer.css_resources
+        head_css_urls = {resource.url for resource in head_css_resources}
+        head_context = dict(context, extra_css=css_links(head_css_resources))
+        try:
+            if shell:
+                yield shell.head(head_context)
+            else:
+                yield render_to_string('shark/base_head.html', head_context, self.request)
+
+            yield from profile_generator(self.profiler, 'render', renderer.render_chunks('        ', content))
+            if self.show_profiler_panel:
+                yield self.profiler.panel_html()
+
+            renderer.resources.add_resources(self.resources)
+            tail_css = [css_links([resource for resource in renderer.css_resources if resource.url not in head_css_urls])]
+            if renderer.css:
+                tail_css.append('        <style>\r\n' + renderer.css + '\r\n        </style>')
+            tail_context = dict(
+                context,
+                tail_css='\r\n'.join([css for css in tail_css if css]),
+                extra_js=js_scripts(renderer.js_files),
+                javascript=renderer.js
+            )
+            if shell:
+                yield shell.tail(tail_context)
+            else:
+                yield render_to_string('shark/base_tail.html', tail_context, self.request)
+        finally:
+            # Also when the client went away or rendering failed halfway
+            if self.profiler is not None:
+                self.profiled()
 
     def render(self, request, *args, **kwargs):
         #Always send the crsf token
@@ -189,23 +486,69 @@ class BasePageHandler(BaseHandler):
         self.user = self.request.user
 
         if request.method == 'GET':
-            self.init(request)
+            with profile_phase(self.profiler, 'init'):
+                self.init(request)
+
+            etag, last_modified = self.get_validators(request, args, kwargs)
+            validated = etag is not None or last_modified is not None
+            if not_modified(request, etag, last_modified):
+                # The client keeps using its copy of the page, and posts actions with its page token
+                refresh_page_state(self.get_cache_key(request, args, kwargs))
+                return add_validators(HttpResponseNotModified(), etag, last_modified)
+
             if SharkSettings.SHARK_GOOGLE_ANALYTICS_CODE:
                 self += GoogleAnalyticsTracking(SharkSettings.SHARK_GOOGLE_ANALYTICS_CODE)
+            # The timings are also recorded when rendering fails, a streaming page records them when it's sent
+            record_profile = self.profiler is not None
             try:
-                result = self.render_page(request, *args, **kwargs)
+                with profile_phase(self.profiler, 'render_page'):
+                    result = self.render_page(request, *args, **kwargs)
+
+                if result is None:
+                    result = self.output_html(args, kwargs)
+                    # Not set on the responses of handlers that override output_html
+                    page_state = getattr(result, 'page_state', None)
+                    if page_state is not None:
+                        if validated and page_state[1]:
+                            remember_page_state(self.get_cache_key(request, args, kwargs), page_state)
+                        if etag is None and self.etag and not self.streaming:
+                            etag = content_etag(result.content)
+                    add_validators(result, etag, last_modified)
+                    if self.profiler is not None:
+                        # A streaming response only has the timings up to the start of the stream
+                        result['Server-Timing'] = self.profiler.server_timing()
+                        record_profile = not self.streaming
+                return result
             except NotFound404:
                 raise Http404()
-            else:
-                if result is None:
-                    return self.output_html(args, kwargs)
-                else:
-                    return result
+            finally:
+                if record_profile:
+                    self.profiled()
         elif request.method == 'POST':
-            action = self.request.POST.get('action', '')
-            keep_variables = json.loads(self.request.POST.get('keep_variables', '{}'))
+            if 'job' in request.POST:
+                return commands_response(job_commands(request.POST['job']))
+
+            actions = [(self.__getattribute__(action), arguments) for action, arguments in self.get_actions(request)]
+
+            # When every action declares the variables it updates only those get a placeholder
+            updated_names = set()
+            for action_function, arguments in actions:
+                if getattr(action_function, 'updates', None) is None:
+                    updated_names = None
+                    break
+                updated_names.update(action_function.updates)
+
+            page_token = request.POST.get('page_token', '')
+            keep_variables = load_page_state(page_token) if page_token else {}
+            if keep_variables is None:
+                # The state of the page has expired, the page needs to be loaded again
+                return commands_response([['redirect', request.get_full_path()]])
+
             keep_variable_objects = []
             for variable_name in keep_variables:
+                if updated_names is not None and variable_name not in updated_names:
+                    continue
+
                 placeholder = PlaceholderWebObject(
                     self,
                     keep_variables[variable_name]['id'],
@@ -215,33 +558,93 @@ class BasePageHandler(BaseHandler):
 
                 self.__setattr__(variable_name, placeholder)
 
-            arguments = {}
-            for argument in self.request.POST:
-                if argument not in ['action', 'keep_variables', 'csrfmiddlewaretoken']:
-                    arguments[argument] = self.request.POST[argument]
-
-            self.renderer = Renderer()
-
-            if action:
-                self.__getattribute__(action)(*args, **arguments)
-
-            javascript = [self.javascript]
-
-            for obj in keep_variable_objects:
-                self.renderer.render_variables(obj.variables)
-
-            self.renderer.render_all(self.items)
-            javascript.append(self.renderer.js)
-
-            for obj in keep_variable_objects:
-                javascript.extend([jq.js(self.renderer) for jq in obj.jqs])
-
-            data = {'javascript': ''.join(javascript),
-                    'html': '',
-                    'data': ''}
-            json_data = json.dumps(data)
-
-            return HttpResponse(json_data)
+            commands = []
+            background_actions = []
+            for action_function, arguments in actions:
+                if getattr(action_function, 'background', False):
+                    background_actions.append((action_function, arguments))
+                else:
+                    commands.extend(self.run_action(action_function, args, arguments, keep_variable_objects))
+
+            # Background actions run after the others, so they have the handler to themselves
+            if background_actions:
+                job_id = start_job(lambda job_id: self.run_background(job_id, background_actions, args,
+                                                                      keep_variable_objects))
+                commands.append(['poll', job_id, POLL_INTERVAL])
+
+            return commands_response(commands)
+
+    def run_background(self, job_id, actions, args, keep_variable_objects):
+        self.job_id = job_id
+        commands = []
+        for action_function, arguments in actions:
+            commands.extend(self.run_action(action_function, args, arguments, keep_variable_objects))
+        return commands
+
+    def progress(self, progress, message=''):
+        """
+        Reports the progress of a background action to the browser, which shows it by triggering the shark:progress
+        event on the document.
+        :param progress: Part of the action that's done, from 0 to 1
+        """
+        if self.job_id:
+            set_progress(self.job_id, progress, message)
+
+    def get_actions(self, request):
+        """
+        :return: A list of (action name, arguments) from the POST. base.js sends the actions issued at the same time
+                 together as a json list of [action, arguments] in 'actions', forms send one action with its
+                 arguments as separate fields.
+        """
+        if 'actions' in request.POST:
+            return [(action, {name: post_value(value) for name, value in arguments.items()})
+                    for action, arguments in json.loads(request.POST['actions'])]
+
+        action = request.POST.get('action', '')
+        if not action:
+            return []
+
+        arguments = {}
+        for argument in request.POST:
+            if argument not in ['action', 'page_token', 'csrfmiddlewaretoken']:
+                arguments[argument] = request.POST[argument]
+        return [(action, arguments)]
+
+    def run_action(self, action_function, args, arguments, keep_variable_objects):
+        """
+        Runs one action and returns the commands it produced.
+        """
+        self.renderer = Renderer()
+
+        # Only the Objects added by the action are rendered, to collect their javascript
+        added = Objects()
+        base_object, self.base_object = self.base_object, added
+        try:
+            action_function(*args, **arguments)
+        finally:
+            self.base_object = base_object
+
+        commands = []
+        if self.javascript:
+            commands.append(js_command(self.javascript))
+            self.javascript = ''
+        commands.extend(self.commands)
+        self.commands = []
+
+        for obj in keep_variable_objects:
+            self.renderer.render_variables(obj.variables)
+
+        if added:
+            self.renderer.render_all(added)
+        if self.renderer.js:
+            commands.append(js_command(self.renderer.js))
+
+        for obj in keep_variable_objects:
+            for jq in obj.jqs:
+                commands.extend(jq.commands(self.renderer))
+            obj.jqs = []
+
+        return commands
 
     def __iadd__(self, other):
         self.base_object += other
@@ -255,13 +658,12 @@ class BasePageHandler(BaseHandler):
             self += script
             return
 
-        if isinstance(script, BaseAction):
-            script = script.js
-
         if self.request.method == 'GET':
             self += Script(script)
+        elif isinstance(script, BaseAction):
+            self.commands.extend(script.commands(self.renderer))
         else:
-            self.javascript += ';' + script
+            self.commands.append(js_command(script))
 
     def render_page(self, request):
         raise NotImplementedError
@@ -284,7 +686,10 @@ class BasePageHandler(BaseHandler):
         return JS('$("#resource-{}-{}").attr("href", "{}").on("load", function(){{$(window).resize()}});'.format(resource.module, resource.name, resource.url))
 
     def redirect(self, url):
-        self.add_javascript('window.location="{}"'.format(urlquote(url, ':/@')))
+        if self.request.method == 'GET':
+            self.add_javascript('window.location="{}"'.format(urlquote(url, ':/@')))
+        else:
+            self.commands.append(['redirect', urlquote(url, ':/@')])
 
     def _form_post(self, *args, **kwargs):
         form_data = signing.loads(kwargs.pop('form_data'), serializer=lambda: pickle)
@@ -311,11 +716,11 @@ class BasePageHandler(BaseHandler):
                         if isinstance(id, int):
                             id = '{}_{}'.format(field_error.__class__.__name__, id)
 
-                        selector = '$("#{}")'.format(id)
                         error_renderer = Renderer()
                         field_error.render_error(error_renderer, outcome)
-                        self.javascript += JQ(selector).append_raw(error_renderer.html).js(error_renderer)
-                        self.javascript += error_renderer.js
+                        self.commands.extend(jq_by_id(id).append_raw(error_renderer.html).commands(error_renderer))
+                        if error_renderer.js:
+                            self.commands.append(js_command(error_renderer.js))
 
         if has_error:
             return
@@ -385,16 +790,12 @@ class BaseContainerPageHandler(BasePageHandler):
 
 
 def shark_django_handler(request, *args, handler=None, **kwargs):
-    handler_instance = handler()
-    outcome = handler_instance.render_base(request, *args, **kwargs)
-    return outcome
+    return handler.handle(request, *args, **kwargs)
 
 
 @csrf_exempt
 def shark_django_handler_no_csrf(request, *args, handler=None, **kwargs):
-    handler_instance = handler()
-    outcome = handler_instance.render_base(request, *args, **kwargs)
-    return outcome
+    return handler.handle(request, *args, **kwargs)
 
 
 def shark_django_redirect_handler(request, *args, handler=None, function=None, **kwargs):
@@ -410,8 +811,24 @@ def shark_django_redirect_handler(request, *args, handler=None, function=None, *
 
 
 class StaticPage(BasePageHandler):
+    page = None
+
+    def load_page(self, url_name):
+        # Loaded once for version_key, last_modified and render_page
+        if self.page is None:
+            self.page = StaticPageModel.load(url_name)
+        return self.page
+
+    def version_key(self, request, url_name):
+        page = self.load_page(url_name)
+        return page.modified.isoformat() if page and page.modified else None
+
+    def last_modified(self, request, url_name):
+        page = self.load_page(url_name)
+        return page.modified if page else None
+
     def render_page(self, request, url_name):
-        page = StaticPageModel.load(url_name)
+        page = self.load_page(url_name)
         if not page:
             raise NotFound404()
 
@@ -424,13 +841,13 @@ class StaticPage(BasePageHandler):
                 self.nav.right_items.append(NavLink('Edit Page', reverse('admin:shark_staticpage_change', args=[page.url_name])))
 
     @classmethod
-    def url(cls, *args, **kwargs):
-        return URL(reverse('shark:shark_static_page', args=args, kwargs=kwargs), False)
+    def route_name(cls):
+        return 'shark:shark_static_page'
 
     @classmethod
     def sitemap(cls):
-        pages = models.StaticPage.objects.filter(sitemap=True).all()
-        return [sp.url_name for sp in pages]
+        add_dependency(models.StaticPage)
+        return list(models.StaticPage.objects.filter(sitemap=True).values_list('url_name', flat=True))
 
 
 def markdown_preview(request):
@@ -462,12 +879,43 @@ class Robots(BaseHandler):
         return False
 
 
+def accepts_encoding(request, encoding):
+    """
+    :return: Whether the Accept-Encoding header of the request allows the content coding, by name or with *. A coding
+             with q=0 is refused.
+    """
+    qualities = {}
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, *params = coding.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    return qualities.get(encoding, qualities.get('*', 0.0)) > 0
+
+
+# Most urls in one sitemap, as allowed by the sitemap protocol. Larger sitemaps are split up with a sitemap index.
+SITEMAP_SIZE = 50000
+
+
 class SiteMap(BaseHandler):
+    """
+    The urls of every handler are cached, and only reloaded when the dependencies recorded while getting them change
+    or after SHARK_SITEMAP_CACHE_TIMEOUT seconds. The sitemap is streamed, or sent gzipped from the cache to clients
+    that accept it.
+    """
     route = '^sitemap.xml$'
 
-    def get_urls(self, include_false=False):
-        urls = set()
-
+    def get_handlers(self):
+        """
+        :return: The handlers in the urlconf, sorted by name
+        """
         handlers = set()
 
         def add_patterns(patterns):
@@ -476,34 +924,131 @@ class SiteMap(BaseHandler):
                     add_patterns(pattern.url_patterns)
                 elif isinstance(pattern, RegexURLPattern):
                     if 'handler' in pattern.default_args and issubclass(pattern.default_args['handler'], BaseHandler):
-                        handler = pattern.default_args['handler']
-                        if handler not in handlers:
-                            handlers.add(handler)
-                            for args in handler.get_sitemap(include_false):
-                                if isinstance(args, str) or not isinstance(args, Iterable):
-                                    args=[args]
-                                urls.add(handler.url(*args))
+                        handlers.add(pattern.default_args['handler'])
 
         add_patterns(get_resolver().url_patterns)
 
-        return urls
+        return sorted(handlers, key=lambda handler: handler.get_unique_name())
+
+    def get_handler_urls(self, include_false=False):
+        """
+        :return: A list with for every handler a dict with its sorted urls and a digest of them
+        """
+        handlers = self.get_handlers()
+        keys = [make_key('shark:sitemap:', handler.get_unique_name(), include_false, get_urlconf(), get_script_prefix())
+                for handler in handlers]
+        cached = cache.get_many(keys)
+        version_keys = {version_key for entry in cached.values() for version_key in entry['versions']}
+        current = cache.get_many(list(version_keys)) if version_keys else {}
+
+        handler_urls = []
+        for handler, key in zip(handlers, keys):
+            entry = cached.get(key)
+            if entry is None or not versions_current(entry['versions'], current):
+                with track_dependencies() as dependencies:
+                    urls = sorted(str(url) for url in handler.urls(handler.get_sitemap(include_false)))
+                entry = {'urls': urls, 'digest': make_key('', *urls), 'versions': dependency_versions(dependencies)}
+                cache.set(key, entry, SharkSettings.SHARK_SITEMAP_CACHE_TIMEOUT)
+            handler_urls.append(entry)
+
+        return handler_urls
 
-    def render(self, request):
-        lines = []
-        lines.append('<?xml version="1.0" encoding="UTF-8"?>')
-        lines.append('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">')
-        handlers = set()
-        for url in self.get_urls():
-            lines.append('    <url><loc>{}</loc></url>'.format(request.build_absolute_uri(url.__str__())))
+    def get_urls(self, include_false=False):
+        return {URL(url, False) for entry in self.get_handler_urls(include_false) for url in entry['urls']}
 
-        lines.append('</urlset>')
-        return HttpResponse('\r\n'.join(lines))
+    def render(self, request):
+        handler_urls = self.get_handler_urls()
+        count = sum(len(entry['urls']) for entry in handler_urls)
+        digests = [entry['digest'] for entry in handler_urls]
+        if count <= SITEMAP_SIZE:
+            return self.xml_response(request, lambda: self.urlset_lines(request, handler_urls, 0, count), digests)
+
+        def index_lines():
+            yield '<?xml version="1.0" encoding="UTF-8"?>'
+            yield '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            for number in range(1, (count - 1) // SITEMAP_SIZE + 2):
+                yield '    <sitemap><loc>{}</loc></sitemap>'.format(
+                    escape(request.build_absolute_uri(str(SiteMapPart.url(number))))
+                )
+            yield '</sitemapindex>'
+
+        return self.xml_response(request, index_lines, digests + ['index'])
+
+    def urlset_lines(self, request, handler_urls, start, stop):
+        """
+        Generates the lines of a sitemap with the urls from start up to stop
+        """
+        base = request.build_absolute_uri('/')[:-1]
+        yield '<?xml version="1.0" encoding="UTF-8"?>'
+        yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        position = 0
+        for entry in handler_urls:
+            urls = entry['urls']
+            if position + len(urls) > start and position < stop:
+                for url in urls[max(start - position, 0):stop - position]:
+                    yield '    <url><loc>{}</loc></url>'.format(escape(base + url))
+            position += len(urls)
+        yield '</urlset>'
+
+    def xml_response(self, request, lines, etag_parts):
+        """
+        :param lines: Function that returns the lines of the xml
+        :param etag_parts: Values that together change whenever the xml does
+        """
+        etag = make_etag(request.build_absolute_uri(), *etag_parts)
+        if not_modified(request, etag):
+            response = HttpResponseNotModified()
+        elif accepts_encoding(request, 'gzip'):
+            key = make_key('shark:sitemap:gzip:', etag)
+            content = cache.get(key)
+            if content is None:
+                content = gzip.compress('\r\n'.join(lines()).encode('utf-8'))
+                cache.set(key, content, SharkSettings.SHARK_SITEMAP_CACHE_TIMEOUT)
+            response = HttpResponse(content, content_type='application/xml')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = StreamingHttpResponse(self.stream_lines(lines()), content_type='application/xml')
+
+        # Every response varies, the 304 too, so caches keep the plain and gzipped sitemaps apart
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return add_validators(response, etag)
+
+    @staticmethod
+    def stream_lines(lines, chunk_size=1000):
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) == chunk_size:
+                yield '\r\n'.join(chunk) + '\r\n'
+                chunk = []
+        yield '\r\n'.join(chunk)
 
     @classmethod
     def sitemap(cls):
         return False
 
 
+class SiteMapPart(SiteMap):
+    """
+    One of the sitemaps listed in the sitemap index, when there are more urls than fit in one sitemap.
+    """
+    route = r'^sitemap-(\d+).xml$'
+
+    def render(self, request, number):
+        number = int(number)
+        handler_urls = self.get_handler_urls()
+        count = sum(len(entry['urls']) for entry in handler_urls)
+        start = (number - 1) * SITEMAP_SIZE
+        if count <= SITEMAP_SIZE or number < 1 or start >= count:
+            raise Http404()
+
+        return self.xml_response(
+            request,
+            lambda: self.urlset_lines(request, handler_urls, start, start + SITEMAP_SIZE),
+            [entry['digest'] for entry in handler_urls] + [number]
+        )
+
+
 class Favicon(BaseHandler):
     route = '^favicon.ico$'
 
@@ -511,6 +1056,26 @@ class Favicon(BaseHandler):
         return HttpResponseRedirect(staticfiles_storage.url('icons/favicon-32x32.png'))
 
 
+class ScriptHandler(BaseHandler):
+    """
+    Serves the javascript of run-script commands, see shark.actions.js_command
+    """
+    route = r'^shark/script/([0-9a-f]+)\.js$'
+
+    def render(self, request, key):
+        js = load_script(key)
+        if js is None:
+            raise Http404('Script expired')
+
+        response = HttpResponse(js, content_type='application/javascript')
+        response['Cache-Control'] = 'private, max-age={}'.format(SCRIPT_TIMEOUT)
+        return response
+
+    @classmethod
+    def sitemap(cls):
+        return False
+
+
 class GoogleVerification(BaseHandler):
     def render(self, request):
         return HttpResponse('google-site-verification: {}.html'.format(SharkSettings.SHARK_GOOGLE_VERIFICATION))
@@ -0,0 +1,126 @@
+import logging
+import threading
+import uuid
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.db import connections
+
+from shark.base import Enumeration, IdScope
+from shark.common import RequestLocals
+from shark.settings import SharkSettings
+
+# Seconds the status and result of a job are kept in the cache
+JOB_TIMEOUT = 60 * 60
+
+# Milliseconds the browser waits before asking for the status of a job again
+POLL_INTERVAL = 1000
+
+
+class JobStatus(Enumeration):
+    running = 1
+    done = 2
+    failed = 3
+
+
+class ImmediateExecutor(Executor):
+    """
+    Runs the job as soon as it's submitted, in the thread of the request. Set SHARK_BACKGROUND_EXECUTOR to
+    'shark.jobs.ImmediateExecutor' to run background actions this way in tests.
+    """
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+class ThreadExecutor(ThreadPoolExecutor):
+    """
+    Thread pool that closes the database connections a job opened when it's done.
+    """
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(self.run, fn, args, kwargs)
+
+    @staticmethod
+    def run(fn, args, kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            connections.close_all()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    :return: The executor for background actions, an instance of the class in SHARK_BACKGROUND_EXECUTOR or a thread
+             pool with SHARK_BACKGROUND_WORKERS threads
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if SharkSettings.SHARK_BACKGROUND_EXECUTOR:
+                module_name, class_name = SharkSettings.SHARK_BACKGROUND_EXECUTOR.rsplit('.', 1)
+                module = __import__(module_name, fromlist=[class_name])
+                _executor = getattr(module, class_name)()
+            else:
+                _executor = ThreadExecutor(SharkSettings.SHARK_BACKGROUND_WORKERS)
+
+    return _executor
+
+
+def job_key(job_id):
+    return 'shark:job:' + job_id
+
+
+def start_job(function):
+    """
+    Runs function in the background executor, with the id of the job. It should return a list of commands for
+    apply_commands in base.js, which are sent to the browser when it polls the job after it's done. The function runs
+    with the language, urlconf and script prefix of the request that started it.
+    :return: The id of the job
+    """
+    job_id = uuid.uuid4().hex
+    cache.set(job_key(job_id), {'status': JobStatus.running, 'progress': 0, 'message': ''}, JOB_TIMEOUT)
+    get_executor().submit(run_job, job_id, function, RequestLocals())
+    return job_id
+
+
+def run_job(job_id, function, request_locals):
+    try:
+        with request_locals, IdScope('j{}_'.format(job_id[:8])):
+            commands = function(job_id)
+        cache.set(job_key(job_id), {'status': JobStatus.done, 'progress': 1, 'message': '', 'commands': commands},
+                  JOB_TIMEOUT)
+    except Exception:
+        logging.exception('Background action failed')
+        cache.set(job_key(job_id), {'status': JobStatus.failed, 'progress': 1, 'message': ''}, JOB_TIMEOUT)
+
+
+def set_progress(job_id, progress, message=''):
+    """
+    :param progress: Part of the job that's done, from 0 to 1
+    """
+    cache.set(job_key(job_id), {'status': JobStatus.running, 'progress': progress, 'message': message}, JOB_TIMEOUT)
+
+
+def job_commands(job_id):
+    """
+    :return: The commands to send to a browser that polls the job. The progress is sent as a progress command,
+             followed by another poll while the job is running, or by the commands of the job when it's done.
+    """
+    job = cache.get(job_key(job_id))
+    if job is None:
+        return [['progress', job_id, JobStatus.name(JobStatus.failed), 1, '']]
+
+    commands = [['progress', job_id, JobStatus.name(job['status']), job['progress'], job['message']]]
+    if job['status'] == JobStatus.running:
+        commands.append(['poll', job_id, POLL_INTERVAL])
+    elif job['status'] == JobStatus.done:
+        commands.extend(job['commands'])
+    return commands
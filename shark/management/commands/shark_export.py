@@ -0,0 +1,183 @@
+import json
+import os
+import shutil
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import resolve
+from django.db import connections
+from django.http import Http404, StreamingHttpResponse
+from django.test import RequestFactory
+
+from shark.cache import track_dependencies, dependency_versions, versions_current, code_version
+from shark.handler import SiteMap
+
+MANIFEST = '.shark_export.json'
+
+
+def export_path(output, url):
+    """
+    :return: The file for the page at url. Pages are written as index.html in a directory of their own, unless the last
+             part of the url has an extension, like sitemap.xml.
+    """
+    path = url.lstrip('/')
+    if not path or path.endswith('/'):
+        path += 'index.html'
+    elif '.' not in path.rsplit('/', 1)[-1]:
+        path += '/index.html'
+    return os.path.join(output, *path.split('/'))
+
+
+def export_page(url, output, host, secure, etag):
+    """
+    Renders the page at url and writes it to its file in output. Runs in the worker processes.
+    :return: The url, the status code, the ETag, the versions of the dependencies of the page, and the traceback if
+             rendering it failed
+    """
+    if not apps.ready:
+        django.setup()
+
+    headers = {'HTTP_HOST': host}
+    if etag:
+        headers['HTTP_IF_NONE_MATCH'] = etag
+    request = RequestFactory().get(url, secure=secure, **headers)
+    request.user = AnonymousUser()
+
+    with track_dependencies() as dependencies:
+        try:
+            match = resolve(request.path_info)
+            response = match.func(request, *match.args, **match.kwargs)
+            if isinstance(response, StreamingHttpResponse):
+                content = b''.join(response.streaming_content)
+            else:
+                content = response.content
+
+            if response.status_code == 200:
+                path = export_path(output, url)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(content)
+        except Http404:
+            return url, 404, None, {}, None
+        except Exception:
+            return url, 500, None, {}, traceback.format_exc()
+
+    return url, response.status_code, response.get('ETag'), dependency_versions(dependencies), None
+
+
+class Command(BaseCommand):
+    help = 'Renders every page in the sitemap, and the pages left out of it, to html files that can be served as ' \
+           'static files. The manifest in the output directory has the ETag of every page and the versions of ' \
+           'the records it depends on. Pages whose records and code did not change are skipped, pages that reply ' \
+           '304 to the ETag of the last export are not written again. The versions are kept in the Django cache, ' \
+           'pages are only skipped when that cache is shared between runs, like memcached or redis.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Directory to write the pages to')
+        parser.add_argument('--host', default=None, help='Host name the pages are rendered for')
+        parser.add_argument('--https', action='store_true', help='Render the pages as served over https')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of processes rendering pages, 1 renders them in this process')
+        parser.add_argument('--force', action='store_true', help='Render all pages, even if they didn\'t change')
+        parser.add_argument('--no-static', action='store_true', help='Don\'t copy the static files')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        host = options['host'] or next(
+            (allowed for allowed in settings.ALLOWED_HOSTS if allowed not in ('*', '') and not allowed.startswith('.')),
+            'localhost'
+        )
+
+        manifest_path = os.path.join(output, MANIFEST)
+        manifest = {}
+        if not options['force'] and os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+
+        urls = sorted(str(url) for url in SiteMap().get_urls(include_false=True))
+        code = code_version()
+
+        def unchanged(url):
+            # Pages without recorded dependencies may depend on anything, they are always rendered
+            page = manifest.get(url)
+            return page is not None and page.get('code') == code and page.get('versions') and \
+                versions_current(page['versions']) and os.path.exists(export_path(output, url))
+
+        todo = [url for url in urls if not unchanged(url)]
+        new_manifest = {url: manifest[url] for url in urls if url not in todo}
+        jobs = [(url, output, host, options['https'],
+                 manifest.get(url, {}).get('etag') if os.path.exists(export_path(output, url)) else None)
+                for url in todo]
+        if options['workers'] > 1 and len(todo) > 1:
+            # The workers are forked, they can't share the database connections of this process
+            connections.close_all()
+            with ProcessPoolExecutor(options['workers']) as executor:
+                futures = [(job[0], executor.submit(export_page, *job)) for job in jobs]
+                results = []
+                for url, future in futures:
+                    try:
+                        results.append(future.result())
+                    except Exception:
+                        results.append((url, 500, None, {}, traceback.format_exc()))
+        else:
+            results = [export_page(*job) for job in jobs]
+
+        written = skipped = 0
+        failed = []
+        for url, status, etag, versions, error in results:
+            if status == 200:
+                written += 1
+            elif error is not None:
+                # The page of the last export is kept, and rendered again next time
+                failed.append(url)
+                if url in manifest:
+                    new_manifest[url] = manifest[url]
+                self.stderr.write('Failed {}\n{}'.format(url, error))
+                continue
+            elif status != 304:
+                skipped += 1
+                self.stderr.write('Skipped {}, status {}'.format(url, status))
+                continue
+
+            new_manifest[url] = {'etag': etag, 'versions': versions, 'code': code}
+
+        # Remove the pages that are gone since the last export
+        for url in set(manifest) - set(new_manifest):
+            path = export_path(output, url)
+            if os.path.exists(path):
+                os.remove(path)
+
+        os.makedirs(output, exist_ok=True)
+        with open(manifest_path, 'w') as f:
+            json.dump(new_manifest, f, indent=1, sort_keys=True)
+
+        if not options['no_static']:
+            self.copy_static(output)
+
+        self.stdout.write('{} pages, {} written, {} unchanged, {} skipped, {} failed'.format(
+            len(urls), written, len(urls) - written - skipped - len(failed), skipped, len(failed)
+        ))
+        if failed:
+            raise CommandError('{} pages failed to render'.format(len(failed)))
+
+    def copy_static(self, output):
+        """
+        Copies the static files found by the staticfiles finders, like collectstatic does, to where STATIC_URL points.
+        """
+        if not settings.STATIC_URL or not settings.STATIC_URL.startswith('/'):
+            return
+
+        static_output = os.path.join(output, *settings.STATIC_URL.strip('/').split('/'))
+        for finder in get_finders():
+            for path, storage in finder.list(['CVS', '.*', '*~']):
+                target = os.path.join(static_output, path)
+                source = storage.path(path)
+                if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.copy2(source, target)
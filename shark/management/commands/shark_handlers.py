@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shark.settings import SharkSettings
+from shark.urls import write_handler_manifest
+
+
+class Command(BaseCommand):
+    help = 'Writes the handlers of the installed apps to the SHARK_HANDLER_MANIFEST file, so the urls can be set ' \
+           'up without importing the views of every app. The manifest is not used once one of the modules it was ' \
+           'written from changes, run it again after every deploy.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='File to write to, SHARK_HANDLER_MANIFEST if not given')
+
+    def handle(self, *args, **options):
+        path = options['path'] or SharkSettings.SHARK_HANDLER_MANIFEST
+        if not path:
+            raise CommandError('Give a path, or set SHARK_HANDLER_MANIFEST')
+
+        write_handler_manifest(path)
+        self.stdout.write('Handler manifest written to {}'.format(path))
@@ -2,6 +2,7 @@ from django.db.models import *
 from django import forms
 from django.http import Http404
 from django.utils.timezone import now
+from shark.cache import add_dependency
 from shark.widgets import MarkdownWidget
 
 
@@ -17,6 +18,7 @@ class SharkModel(Model):
     def load(cls, pk=None):
         if str(pk) in ['', '0', 'None']:
             return cls()
+        add_dependency(cls, pk)
         try:
             return cls.objects.get(pk=pk)
         except cls.DoesNotExist:
@@ -25,6 +27,8 @@ class SharkModel(Model):
     @classmethod
     def load_by_url_name(cls, url_name, raise_404_on_not_found=True):
         value = cls.objects.filter(url_name=url_name).first()
+        # If it's not found, a new record for this url_name would change the outcome
+        add_dependency(cls, value.pk if value else None)
         if raise_404_on_not_found and not value:
             raise Http404()
         return value
@@ -73,6 +77,7 @@ class StaticPage(SharkModel):
     sitemap = BooleanField(verbose_name='Include in SiteMap?', default=True)
     robots_index = BooleanField(verbose_name='robots.txt index?', default=True)
     robots_follow = BooleanField(verbose_name='robots.txt follow?', default=True)
+    modified = DateTimeField(verbose_name='Last modified', auto_now=True)
 
     def get_absolute_url(self):
         from .handler import StaticPage as StaticPageHandler
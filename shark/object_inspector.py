@@ -13,17 +13,27 @@ class ObjectInspector(object):
             obj = getattr(mod, key)
             if inspect.isclass(obj) and issubclass(obj, Object) and key != 'Object' and inspect.getfile(obj)==filename:
 
-                parameters = [p for p in inspect.signature(obj.__init__).parameters][1:]
+                signature = inspect.signature(obj.__init__).parameters
+                parameters = [p for p in signature][1:]
                 param_info = []
 
-                def param(self, value, type, description, default=None):
-                    name = parameters.pop(0)
+                def add_param_info(name, type, description, value, default):
                     param_info.append({
                         'name': name,
                         'type': type,
                         'description': description,
                         'default': iif(value == Default, default, value),
                         'class': iif(value == Default, default, value).__class__.__name__})
+
+                # Parameters declared in the class come first, in the order of the __init__ arguments
+                for declared in obj.parameters:
+                    name = parameters.pop(0)
+                    add_param_info(name, declared.converter, declared.description, signature[name].default,
+                                   declared.default)
+
+                def param(self, value, type, description, default=None):
+                    name = parameters.pop(0)
+                    add_param_info(name, type, description, value, default)
                     return old_param(self, value, type, description, default)
 
                 # Using a custom param function to record the param info
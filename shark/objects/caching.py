@@ -0,0 +1,59 @@
+import hashlib
+
+from django.core.cache import cache
+
+from shark.base import Object, Objects, BaseObject, IdScope
+from shark.cache import track_dependencies, add_dependencies, dependency_versions, versions_current
+from shark.param_converters import ObjectsParam, RawParam, IntegerParam
+
+
+class Cached(Object):
+    """
+    Caches the rendered output of its items. The first render stores the html, javascript, css and resources in the
+    Django cache, later renders with the same key add the stored output without rendering the items again.
+    Pass a function that returns the items to also skip creating the items when the output is cached.
+    The cached output is removed when the models that were read while rendering it change. Fragments with the same
+    key share their output, so every different fragment needs a key of its own.
+    """
+    def __init__(self, key, items=None, ttl=300, **kwargs):
+        if not key:
+            raise ValueError('Cached needs a key to store the rendered items under')
+        self.init(kwargs)
+        self.key = self.param(key, RawParam, 'Key to store the rendered items under')
+        if callable(items) and not isinstance(items, BaseObject):
+            self.items_function = items
+            self.items = Objects()
+        else:
+            self.items_function = None
+            self.items = self.param(items, ObjectsParam, 'Items to cache, or a function that returns the items')
+        self.ttl = self.param(ttl, IntegerParam, 'Seconds to keep the output cached, None to never expire')
+
+    @property
+    def key_hash(self):
+        return hashlib.md5(self.key.encode('utf-8')).hexdigest()
+
+    @property
+    def cache_key(self):
+        return 'shark:fragment:' + self.key_hash
+
+    def get_html(self, renderer):
+        fragment = cache.get(self.cache_key)
+        if fragment is None or not versions_current(fragment.get('versions')):
+            # The html ids in the fragment get a prefix, so they can't clash with those of the pages it's added to
+            with track_dependencies() as dependencies, IdScope('c{}_'.format(self.key_hash[:8])):
+                if self.items_function:
+                    self.items = ObjectsParam.convert(self.items_function(), self)
+                fragment = renderer.render_fragment(self.items)
+            fragment['dependencies'] = dependencies
+            fragment['versions'] = dependency_versions(dependencies)
+            cache.set(self.cache_key, fragment, self.ttl)
+        else:
+            # A page that includes the fragment depends on the same records
+            add_dependencies(fragment['dependencies'])
+
+        renderer.append_fragment(fragment)
+
+    @classmethod
+    def example(cls):
+        from shark.objects.layout import Panel
+        return Cached('example-panel', lambda: Panel('Rendered once, then served from the cache.'))
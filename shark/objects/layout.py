@@ -1,6 +1,6 @@
 from collections import Iterable
 
-from shark.base import Object, Default, Objects, Enumeration
+from shark.base import Object, Default, Objects, Enumeration, Param
 from shark.objects.enumerations import QuickFloat
 from shark.param_converters import ObjectsParam, BooleanParam, IntegerParam
 from shark.resources import Resource
@@ -106,6 +106,8 @@ class Br(Object):
     """
     Creates the &lt;br/&gt; html tag.
     """
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         self.init(kwargs)
 
@@ -121,9 +123,13 @@ class Row(Object):
     """
     A Bootstrap Row.
     """
+    parameters = [
+        Param('items', ObjectsParam, 'Items in the row')
+    ]
+
     def __init__(self, items=None,  **kwargs):
         self.init(kwargs)
-        self.items = self.param(items, ObjectsParam, 'Items in the row')
+        self.set_parameters(items)
         self.add_class('row')
 
     def get_html(self, html):
@@ -226,12 +232,16 @@ class Div(Object):
     """
     A flexible &lt;div&gt; element.
     """
+    parameters = [
+        Param('items', ObjectsParam, 'Items in the row', None),
+        Param('quick_float', QuickFloat, 'Quick float to pull div left or right'),
+        Param('centered', BooleanParam, 'Whether the div is center block'),
+        Param('clearfix', BooleanParam, 'indicates whether to use clearfix')
+    ]
+
     def __init__(self, items=None, quick_float=None, centered=False, clearfix=False, **kwargs):
         self.init(kwargs)
-        self.items = self.param(items, ObjectsParam, 'Items in the row', Objects())
-        self.quick_float = self.param(quick_float, QuickFloat, 'Quick float to pull div left or right')
-        self.centered = self.param(centered, BooleanParam, 'Whether the div is center block')
-        self.clearfix = self.param(clearfix, BooleanParam, 'indicates whether to use clearfix')
+        self.set_parameters(items, quick_float, centered, clearfix)
         if self.quick_float:
             self.add_class(QuickFloat.name(self.quick_float))
         if self.centered:
@@ -1,7 +1,7 @@
 from collections import Iterable
 from django.db.models import Model
 
-from shark.base import Enumeration, Object, Default, Objects, StringParam
+from shark.base import Enumeration, Object, Default, Objects, StringParam, Param
 from shark.param_converters import ObjectsParam, UrlParam, IntegerParam
 
 
@@ -85,11 +85,15 @@ class TableHead(Object):
 
 
 class TableHeadColumn(Object):
+    parameters = [
+        Param('items', ObjectsParam, 'Content of the column', None),
+        Param('colspan', StringParam, 'Columns the cell spans'),
+        Param('rowspan', StringParam, 'Rows the cell spans')
+    ]
+
     def __init__(self, items=Default, colspan=0, rowspan=0, **kwargs):
         self.init(kwargs)
-        self.items = self.param(items, ObjectsParam, 'Content of the column', Objects())
-        self.colspan = self.param(colspan, StringParam, 'Columns the cell spans')
-        self.rowspan = self.param(rowspan, StringParam, 'Rows the cell spans')
+        self.set_parameters(items, colspan, rowspan)
 
         self.add_attribute('colspan', self.colspan)
         self.add_attribute('rowspan', self.rowspan)
@@ -101,10 +105,14 @@ class TableHeadColumn(Object):
 
 
 class TableRow(Object):
+    parameters = [
+        Param('columns', ObjectsParam, 'Columns in the table', None),
+        Param('url', UrlParam, 'Action to do when clicked')
+    ]
+
     def __init__(self, columns=Default, action=None, **kwargs):
         self.init(kwargs)
-        self.columns = self.param(columns, ObjectsParam, 'Columns in the table', Objects())
-        self.url = self.param(action, UrlParam, 'Action to do when clicked')
+        self.set_parameters(columns, action)
 
     def get_html(self, html):
         data_href = ' data-href="{}"'.format(self.url) if self.url else ''
@@ -114,12 +122,16 @@ class TableRow(Object):
 
 
 class TableColumn(Object):
+    parameters = [
+        Param('items', ObjectsParam, 'Content of the column', None),
+        Param('colspan', IntegerParam, 'Span number of columns'),
+        Param('rowspan', IntegerParam, 'Span number of rows'),
+        Param('align', StringParam, 'Align left, right or center')
+    ]
+
     def __init__(self, items=Default, colspan=0, rowspan=0, align='', **kwargs):
         self.init(kwargs)
-        self.items = self.param(items, ObjectsParam, 'Content of the column', Objects())
-        self.colspan = self.param(colspan, IntegerParam, 'Span number of columns')
-        self.rowspan = self.param(rowspan, IntegerParam, 'Span number of rows')
-        self.align = self.param(align, StringParam, 'Align left, right or center')
+        self.set_parameters(items, colspan, rowspan, align)
 
         if self.colspan:
             self.add_attribute('colspan', self.colspan)
@@ -136,6 +148,10 @@ class TableColumn(Object):
 
 
 def create_table(data, columns, transforms = None, include_header = True, row_actions = None, table_style = None):
+    """
+    :param row_actions: Function that returns the action for a row, or a tuple of a handler and the name of the field
+                        to pass to its url
+    """
     transforms = transforms or []
     table = Table(table_style=table_style)
     if data:
@@ -160,9 +176,18 @@ def create_table(data, columns, transforms = None, include_header = True, row_ac
             in_function = lambda row:row
             get_function = lambda row, key: row[key]
 
-        for row in data:
-            if row_actions:
-                table_row = TableRow(action=row_actions(row))
+        if isinstance(row_actions, tuple):
+            # A handler and the field passed to its url, the urls of all rows are reversed at once
+            handler, url_field = row_actions
+            actions = handler.urls([get_function(row, url_field) for row in data])
+        elif row_actions:
+            actions = [row_actions(row) for row in data]
+        else:
+            actions = None
+
+        for i, row in enumerate(data):
+            if actions:
+                table_row = TableRow(action=actions[i])
             else:
                 table_row = TableRow()
 
@@ -3,7 +3,7 @@ from shark.extensions.markdown import MarkdownParam
 from shark.objects.base import Raw
 from shark.objects.enumerations import ButtonStyle, Size, ButtonState
 from shark.objects.layout import Span, Paragraph, Footer
-from shark.base import Object, Default, Objects, StringParam
+from shark.base import Object, Default, Objects, StringParam, Param
 from shark.param_converters import BooleanParam, ObjectsParam, UrlParam, IntegerParam, RawParam
 
 
@@ -18,16 +18,20 @@ class Abbrev(Span):
 
 
 class Anchor(Object):
+    parameters = [
+        Param('text', ObjectsParam, 'Text of the link', None),
+        Param('url', UrlParam, 'Action when clicked', ''),
+        Param('bss', ButtonStyle, 'Visual style of the button'),
+        Param('size', Size, 'indicate size when used as button'),
+        Param('state', ButtonState, 'indicates the button state when used as button'),
+        Param('as_button', BooleanParam, 'Whether the anchor be used as button'),
+        Param('microdata', BooleanParam, 'This anchor is part of a microdata html part.'),
+        Param('new_window', BooleanParam, 'Open in a new window.', Default)
+    ]
+
     def __init__(self, text=Default, url='', bss=ButtonStyle.default, size=Size.default, state=ButtonState.none, as_button=False, microdata=False, new_window=Default, **kwargs):
         self.init(kwargs)
-        self.text = self.param(text, ObjectsParam, 'Text of the link', Objects())
-        self.url = self.param(url, UrlParam, 'Action when clicked', '')
-        self.bss = self.param(bss, ButtonStyle, 'Visual style of the button')
-        self.size = self.param(size, Size, 'indicate size when used as button')
-        self.state = self.param(state, ButtonState, 'indicates the button state when used as button')
-        self.as_button = self.param(as_button, BooleanParam, 'Whether the anchor be used as button')
-        self.microdata = self.param(microdata, BooleanParam, 'This anchor is part of a microdata html part.')
-        self.new_window = self.param(new_window, BooleanParam, 'Open in a new window.', Default)
+        self.set_parameters(text, url, bss, size, state, as_button, microdata, new_window)
 
         if self.as_button:
             self.role = "button"
@@ -118,6 +122,8 @@ class Br(Object):
     """
     Adds a line break.
     """
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         self.init(kwargs)
 
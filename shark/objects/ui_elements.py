@@ -272,6 +272,8 @@ class Caret(Object):
     """
     Adds a caret. See the example.
     """
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         self.init(kwargs)
 
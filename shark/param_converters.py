@@ -4,6 +4,7 @@ from django.db.models import Model
 from django.db.models import QuerySet
 from shark.actions import NoAction, URL, BaseAction, JS, Action
 from shark.base import BaseParamConverter, Objects, Object
+from shark.cache import add_dependency
 from shark.dependancies import escape_html, escape_url
 from shark.objects.enumerations import ButtonStyle, Size, ButtonState, QuickFloat
 
@@ -175,6 +176,8 @@ class ModelParam(BaseParamConverter):
         if value is None:
             return None
         if isinstance(value, Model):
+            if value.pk is not None:
+                add_dependency(value.__class__, value.pk)
             return value
 
         raise TypeError("Parameter isn't a Django Model object")
@@ -188,6 +191,7 @@ class DataTableParam(BaseParamConverter):
         elif isinstance(value, tuple) and len(value)>=2 and isinstance(value[0], list) and isinstance(value[1], list):
             return value
         elif isinstance(value, QuerySet):
+            add_dependency(value.model)
             fields = value._fields
             return (
                 fields,
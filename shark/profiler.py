@@ -0,0 +1,135 @@
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from importlib import import_module
+from time import perf_counter
+
+from shark.dependancies import escape_html
+from shark.settings import SharkSettings
+
+
+class ClassStats(object):
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        # Time including the time spent rendering children, and excluding it
+        self.cumulative = 0.0
+        self.own = 0.0
+
+
+class RenderProfiler(object):
+    """
+    Collects the time spent in the phases of a page request, and the number of renders and time spent per Object
+    class in Renderer.render.
+    """
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.classes = {}
+        self._child_time = []
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def start(self):
+        self._child_time.append(0.0)
+        return perf_counter()
+
+    def stop(self, cls, started):
+        elapsed = perf_counter() - started
+        child_time = self._child_time.pop()
+        if self._child_time:
+            self._child_time[-1] += elapsed
+
+        stats = self.classes.get(cls)
+        if stats is None:
+            stats = self.classes[cls] = ClassStats(cls.__name__)
+        stats.count += 1
+        stats.cumulative += elapsed
+        stats.own += elapsed - child_time
+
+    def top_classes(self, count=None):
+        stats = sorted(self.classes.values(), key=lambda s: s.own, reverse=True)
+        return stats[:count] if count else stats
+
+    def server_timing(self, class_count=5):
+        """
+        :return: The value for the Server-Timing header, the phases followed by the classes with most own time.
+        """
+        timings = ['{};dur={:.2f}'.format(name, seconds * 1000) for name, seconds in self.phases.items()]
+        for stats in self.top_classes(class_count):
+            timings.append('obj-{};dur={:.2f};desc="{} x{}"'.format(stats.name, stats.own * 1000, stats.name, stats.count))
+        return ', '.join(timings)
+
+    def panel_html(self):
+        """
+        :return: A table with all timings, to be added to the bottom of the page
+        """
+        lines = ['<div class="container shark-profiler"><table class="table table-condensed">']
+        lines.append('<tr><th>Phase</th><th colspan="3">ms</th></tr>')
+        for name, seconds in self.phases.items():
+            lines.append('<tr><td>{}</td><td colspan="3">{:.2f}</td></tr>'.format(escape_html(name), seconds * 1000))
+        lines.append('<tr><th>Object</th><th>Renders</th><th>Own ms</th><th>Cumulative ms</th></tr>')
+        for stats in self.top_classes():
+            lines.append('<tr><td>{}</td><td>{}</td><td>{:.2f}</td><td>{:.2f}</td></tr>'.format(
+                escape_html(stats.name), stats.count, stats.own * 1000, stats.cumulative * 1000
+            ))
+        lines.append('</table></div>')
+        return '\r\n'.join(lines)
+
+    def log(self):
+        logging.debug('Shark profile: ' + self.server_timing(None))
+
+
+# The SHARK_PROFILER_HOOK path and the function it was resolved to
+_hook = (None, None)
+
+
+def profile_hook():
+    """
+    :return: The function set in SHARK_PROFILER_HOOK, called with the handler and profiler after every profiled request
+    """
+    global _hook
+    path = SharkSettings.SHARK_PROFILER_HOOK
+    if not path:
+        return None
+
+    if _hook[0] != path:
+        module_name, function_name = path.rsplit('.', 1)
+        _hook = (path, getattr(import_module(module_name), function_name))
+    return _hook[1]
+
+
+@contextmanager
+def profile_phase(profiler, name):
+    """
+    Adds the time spent in the with block to a phase. Does nothing if profiler is None.
+    """
+    if profiler is None:
+        yield
+        return
+
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        profiler.add_phase(name, perf_counter() - started)
+
+
+def profile_generator(profiler, name, generator):
+    """
+    Yields the items of the generator, adding the time spent producing them to a phase.
+    """
+    if profiler is None:
+        yield from generator
+        return
+
+    iterator = iter(generator)
+    while True:
+        started = perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            profiler.add_phase(name, perf_counter() - started)
+        yield item
@@ -0,0 +1,205 @@
+import json
+import time
+import uuid
+
+from django.core.cache import cache
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+
+from shark.actions import js_command
+from shark.base import PlaceholderWebObject, IdScope
+from shark.cache import load_page_state, valid_page_token
+from shark.handler import BaseHandler
+from shark.renderer import Renderer
+from shark.settings import SharkSettings
+
+# Seconds a pushed message waits for the page to pick it up
+MESSAGE_TIMEOUT = 60
+
+# Seconds an event stream stays open, the browser opens a new one when it's closed
+STREAM_TIMEOUT = 25
+
+# Seconds a long poll waits for a message
+POLL_TIMEOUT = 20
+
+# Seconds between looking for new messages in the cache
+CHECK_INTERVAL = 0.5
+
+# Seconds a message that has a number but isn't in the cache is waited for, before it's taken as expired
+MISSING_TIMEOUT = 2
+
+
+def mailbox_key(page_token):
+    return 'shark:push:' + page_token
+
+
+def post_message(page_token, commands):
+    """
+    Adds a list of commands for apply_commands in base.js to the mailbox of the page. The mailbox is a counter in the
+    cache, with every message stored under its number.
+    :return: The number of the message
+    """
+    key = mailbox_key(page_token)
+    cache.add(key, 0, SharkSettings.SHARK_PAGE_STATE_TIMEOUT)
+    try:
+        number = cache.incr(key)
+    except ValueError:
+        # The counter expired in between
+        number = 1
+        cache.set(key, number, SharkSettings.SHARK_PAGE_STATE_TIMEOUT)
+
+    cache.set('{}:{}'.format(key, number), commands, MESSAGE_TIMEOUT)
+    return number
+
+
+def read_messages(page_token, after, skip_missing=False):
+    """
+    post_message stores a message right after it takes its number, so a number without a message may be one that is
+    being stored. Reading stops before it, unless skip_missing.
+    :return: The number of the last message read, a list of (number, commands) for the messages read after the given
+             number, and whether reading stopped at a missing message
+    """
+    key = mailbox_key(page_token)
+    last = cache.get(key) or 0
+    if last < after:
+        # The counter expired and started again
+        after = 0
+    if last == after:
+        return last, [], False
+
+    keys = ['{}:{}'.format(key, number) for number in range(after + 1, last + 1)]
+    found = cache.get_many(keys)
+    messages = []
+    for number, message_key in enumerate(keys, after + 1):
+        if message_key in found:
+            messages.append((number, found[message_key]))
+        elif not skip_missing:
+            return number - 1, messages, True
+    return last, messages, False
+
+
+class MessageReader:
+    """
+    Reads the messages of a page in order. A missing message is waited for up to MISSING_TIMEOUT seconds, after that
+    it has expired and is skipped.
+    """
+    def __init__(self, page_token, after):
+        self.page_token = page_token
+        self.after = after
+        self.missing_since = None
+
+    def read(self):
+        """
+        :return: A list of (number, commands) for the new messages
+        """
+        skip_missing = self.missing_since is not None and time.time() - self.missing_since >= MISSING_TIMEOUT
+        self.after, messages, missing = read_messages(self.page_token, self.after, skip_missing)
+        if not missing:
+            self.missing_since = None
+        elif self.missing_since is None:
+            self.missing_since = time.time()
+        return messages
+
+
+class PageChannel:
+    """
+    Sends updates to a page that is open in a browser, for pages with push = True. The kept variables of the page are
+    available as placeholders like in actions, and send() pushes what was done with them to the page:
+
+        channel = PageChannel(page_token)
+        channel.graph.replace(LineGraph(points))
+        channel.send()
+
+    The page token is in handler.page_token after the page has been rendered. Every process that serves push
+    requests needs to use the same cache, such as memcached or redis.
+
+    Every open page keeps a request to PushHandler running, for up to STREAM_TIMEOUT or POLL_TIMEOUT seconds at a
+    time. With sync workers, as gunicorn and uwsgi use by default, each of those requests takes up a worker, so a few
+    open pages can keep all workers busy. Serve push pages with threaded or async workers, and with more of them than
+    the number of pages that will be open at the same time.
+    """
+    def __init__(self, page_token):
+        self.page_token = page_token
+        self.commands = []
+        self._state = None
+        self._placeholders = []
+
+    def __getattr__(self, name):
+        if self._state is None:
+            self._state = load_page_state(self.page_token) or {}
+        if name not in self._state:
+            raise AttributeError(name)
+
+        placeholder = PlaceholderWebObject(None, self._state[name]['id'], self._state[name]['class_name'])
+        self._placeholders.append(placeholder)
+        self.__dict__[name] = placeholder
+        return placeholder
+
+    def add_javascript(self, script):
+        self.commands.append(js_command(script))
+
+    def send(self):
+        """
+        Pushes the updates made so far to the page.
+        """
+        commands = self.commands
+        with IdScope('p{}_'.format(uuid.uuid4().hex[:8])):
+            renderer = Renderer()
+            for placeholder in self._placeholders:
+                renderer.render_variables(placeholder.variables)
+            if renderer.js:
+                commands.append(js_command(renderer.js))
+            for placeholder in self._placeholders:
+                for jq in placeholder.jqs:
+                    commands.extend(jq.commands(renderer))
+                placeholder.jqs = []
+
+        self.commands = []
+        if commands:
+            post_message(self.page_token, commands)
+
+
+class PushHandler(BaseHandler):
+    """
+    Sends the messages pushed to a page as server-sent events. With ?poll=1 it's a long poll instead, which answers
+    with the messages as json as soon as there are any. Either way the request holds its worker until it's answered,
+    see PageChannel.
+    """
+    route = '^push/$'
+
+    def render(self, request):
+        page_token = request.GET.get('token', '')
+        if not valid_page_token(page_token):
+            raise Http404()
+
+        try:
+            after = int(request.GET.get('after') or request.META.get('HTTP_LAST_EVENT_ID') or 0)
+        except ValueError:
+            return HttpResponseBadRequest()
+
+        if request.GET.get('poll'):
+            deadline = time.time() + POLL_TIMEOUT
+            reader = MessageReader(page_token, after)
+            messages = reader.read()
+            while not messages and time.time() < deadline:
+                time.sleep(CHECK_INTERVAL)
+                messages = reader.read()
+            return JsonResponse({'after': reader.after, 'messages': [commands for number, commands in messages]})
+
+        response = StreamingHttpResponse(self.events(page_token, after), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stops nginx from buffering the events
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def events(self, page_token, after):
+        yield 'retry: 1000\n\n'
+        deadline = time.time() + STREAM_TIMEOUT
+        reader = MessageReader(page_token, after)
+        while time.time() < deadline:
+            for number, commands in reader.read():
+                yield 'id: {}\ndata: {}\n\n'.format(number, json.dumps(commands, separators=(',', ':')))
+            time.sleep(CHECK_INTERVAL)
+
+    @classmethod
+    def sitemap(cls):
+        return False
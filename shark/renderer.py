@@ -1,17 +1,95 @@
+import io
 import json
+import re
 
-from shark.base import Object, Objects, objectify
+from shark.base import Object, Objects, objectify, next_id
 from shark.resources import Resources
 
+# Whitespace before or after these tags is never displayed, so it can be left out of minified html
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'body', 'br', 'dd', 'div', 'dl', 'dt', 'fieldset', 'figcaption',
+    'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'head', 'header', 'hr', 'html', 'iframe', 'li',
+    'link', 'main', 'meta', 'nav', 'ol', 'option', 'p', 'pre', 'script', 'section', 'select', 'style', 'table', 'tbody',
+    'td', 'tfoot', 'th', 'thead', 'title', 'tr', 'ul', 'video'
+}
+FIRST_TAG = re.compile(r'</?([a-zA-Z][a-zA-Z0-9]*)')
+LAST_TAG = re.compile(r'.*</?([a-zA-Z][a-zA-Z0-9]*)[^<]*>$', re.DOTALL)
+
+
+class StringSink:
+    """
+    Writes the html into an io.StringIO. Parts of the output are read back and removed by their offset.
+    """
+    seekable = True
+
+    def __init__(self, buffer=None):
+        self.buffer = io.StringIO() if buffer is None else buffer
+
+    def write(self, text):
+        self.buffer.write(text)
+
+    def tell(self):
+        return self.buffer.tell()
+
+    def read_from(self, offset):
+        self.buffer.seek(offset)
+        return self.buffer.read()
+
+    def truncate(self, offset):
+        self.buffer.seek(offset)
+        self.buffer.truncate()
+
+
+class BytesSink(StringSink):
+    """
+    Writes the html encoded into an io.BytesIO.
+    """
+    def __init__(self, buffer=None, encoding='utf-8'):
+        super().__init__(io.BytesIO() if buffer is None else buffer)
+        self.encoding = encoding
+
+    def write(self, text):
+        self.buffer.write(text.encode(self.encoding))
+
+    def read_from(self, offset):
+        return super().read_from(offset).decode(self.encoding)
 
-class Renderer:
-    object_number = 0
 
-    def __init__(self, handler=None, inline_style_class_base='style_'):
-        self.__class__.object_number += 1
-        self.id = self.__class__.__name__ + '_' + str(self.__class__.object_number)
-        self._html = []
-        self._rendering_to = self._html
+class WriterSink:
+    """
+    Writes the html to anything with a write method, like a file or socket.makefile(). Binary writers get the html
+    encoded. The output can't be read back, html that is rendered to a string is kept in a StringSink instead.
+    """
+    seekable = False
+
+    def __init__(self, writer, encoding='utf-8'):
+        self.writer = writer
+        self.encoding = encoding if isinstance(writer, (io.RawIOBase, io.BufferedIOBase)) else None
+
+    def write(self, text):
+        self.writer.write(text.encode(self.encoding) if self.encoding else text)
+
+
+def make_sink(output=None):
+    """
+    :param output: A sink, io.StringIO, io.BytesIO, anything with a write method or None for a new StringSink
+    """
+    if output is None:
+        return StringSink()
+    elif isinstance(output, (StringSink, WriterSink)):
+        return output
+    elif isinstance(output, io.StringIO):
+        return StringSink(output)
+    elif isinstance(output, io.BytesIO):
+        return BytesSink(output)
+    else:
+        return WriterSink(output)
+
+
+class Renderer:
+    def __init__(self, handler=None, inline_style_class_base='style_', minify=None, output=None):
+        self.id = next_id(self.__class__.__name__)
+        self._sink = make_sink(output)
         self._css = []
         self._css_classes = {}
         self._js = []
@@ -21,7 +99,9 @@ class Renderer:
         self.translate_inline_styles_to_classes = True
         self.inline_style_class_base = inline_style_class_base
         self.resources = Resources()
-        self.parent_tree = []
+        # The Objects being rendered, outermost first, and the same Objects per class they are an instance of
+        self._ancestors = []
+        self._ancestors_by_type = {}
         self.variables = {}
 
         if handler:
@@ -31,8 +111,15 @@ class Renderer:
 
         self.separator = '\r\n'
         self.omit_next_indent = False
+        # The separator after the last line is only written when the next line starts, so inline_render can leave it out
+        self._pending = ''
+
+        # Minified html has no indentation, and line breaks are left out or collapsed into a single \n
+        self.minify = getattr(handler, 'minify_html', False) if minify is None else minify
+        self._after_block_tag = False
 
         self.render_count = 0
+        self.profiler = getattr(handler, 'profiler', None)
 
     def add_css_class(self, css):
         if not css in self._css_classes:
@@ -41,9 +128,38 @@ class Renderer:
 
     def append(self, p_object):
         if isinstance(p_object, str):
-            self._rendering_to.append((' '*self.indent if not self.omit_next_indent else '') + p_object + self.separator)
+            if self.minify:
+                self.append_minified(p_object)
+            else:
+                self.write((' '*self.indent if not self.omit_next_indent else '') + p_object)
+                self._pending = self.separator
             self.omit_next_indent = False
 
+    def write(self, text):
+        if self._pending:
+            self._sink.write(self._pending)
+            self._pending = ''
+        self._sink.write(text)
+
+    def append_minified(self, text):
+        # Text that continues a line or is rendered inline is kept as it is
+        if self.separator and not self.omit_next_indent:
+            text = text.strip()
+            if not text:
+                return
+
+            # The line break of the previous line is left out if it's next to a block level tag
+            if self._pending:
+                match = FIRST_TAG.match(text)
+                if self._after_block_tag or (match and match.group(1).lower() in BLOCK_TAGS):
+                    self._pending = ''
+
+        if text:
+            self.write(text)
+            match = LAST_TAG.match(text)
+            self._after_block_tag = bool(match and match.group(1).lower() in BLOCK_TAGS)
+        self._pending = '\n' if self.separator else ''
+
     def append_css(self, css):
         self._css.append(css.strip())
 
@@ -74,25 +190,64 @@ class Renderer:
 
             if self.translate_inline_styles_to_classes and \
                     isinstance(web_object, Object) and \
-                    'style' in web_object._attributes and web_object._attributes['style']:
-                web_object.add_class(self.add_css_class(web_object._attributes['style']))
-                del web_object._attributes['style']
-
-            if web_object._parent and isinstance(web_object._parent, Object):
-                self.parent_tree.insert(0, web_object._parent)
-                web_object.get_html(self)
-                self.parent_tree.pop(0)
-            else:
-                web_object.get_html(self)
+                    web_object._attribute_dict and web_object._attribute_dict.get('style'):
+                web_object.add_class(self.add_css_class(web_object._attribute_dict['style']))
+                del web_object._attribute_dict['style']
+
+            profiler = self.profiler
+            if profiler is not None:
+                started = profiler.start()
+
+            try:
+                if web_object._parent and isinstance(web_object._parent, Object):
+                    self.push_parent(web_object._parent)
+                    web_object.get_html(self)
+                    self.pop_parent()
+                else:
+                    web_object.get_html(self)
+            finally:
+                if profiler is not None:
+                    profiler.stop(web_object.__class__, started)
 
             self.indent -= len(indent)
 
     def render_all(self, data):
         self.render('', objectify(data))
 
+    def render_chunks(self, indent, web_object):
+        """
+        Renders the same html as render, but as a generator. Lists of Objects that aren't the items of an Object
+        are walked, and the html of each of their items is yielded as soon as it is rendered.
+        """
+        if isinstance(web_object, Objects) and not isinstance(web_object._parent, Object):
+            self.indent += len(indent)
+            for child in web_object:
+                yield from self.render_chunks('', child)
+            self.indent -= len(indent)
+        else:
+            self.render(indent, web_object)
+            chunk = self.flush()
+            if chunk:
+                yield chunk
+
+    def flush(self):
+        """
+        Returns the html rendered so far and removes it from the renderer. Output written to a WriterSink is
+        completed instead, and an empty string is returned.
+        """
+        if not self._sink.seekable:
+            if self._pending and not self.minify:
+                self._sink.write(self._pending)
+            self._pending = ''
+            return ''
+
+        html = self.html
+        self._sink.truncate(0)
+        self._pending = ''
+        return html
+
     def inline_render(self, web_object):
-        if self.separator and len(self._rendering_to) and self._rendering_to[-1].endswith(self.separator):
-            self._rendering_to[-1] = self._rendering_to[-1][:-len(self.separator)]
+        self._pending = ''
         if web_object:
             if not isinstance(web_object, Object) and not isinstance(web_object, Objects):
                 web_object = Objects(web_object)
@@ -108,31 +263,105 @@ class Renderer:
 
         self.omit_next_indent = True
 
+    def start_capture(self):
+        """
+        Starts rendering html that is returned by end_capture instead of being added to the output. The html is
+        written after the output and then removed again, so no copies of the output are made.
+        """
+        state = self._sink, self._pending, self._after_block_tag, self.omit_next_indent
+        if not self._sink.seekable:
+            self._sink = StringSink()
+        self._pending = ''
+        return state, self._sink.tell()
+
+    def end_capture(self, capture):
+        state, offset = capture
+        html = self._read(offset)
+        self._sink.truncate(offset)
+        self._sink, self._pending, self._after_block_tag, self.omit_next_indent = state
+        return html
+
     def render_string(self, web_object):
-        original = self._rendering_to
-        self._rendering_to = []
+        capture = self.start_capture()
         self.render('', web_object)
-        html = self.html
-        self._rendering_to = original
-        return html
+        return self.end_capture(capture)
 
     def render_string_and_js(self, web_object):
-        original = self._rendering_to
+        capture = self.start_capture()
         original_js = self._rendering_js_to
-        self._rendering_to = []
         self._rendering_js_to = []
         self.inline_render(web_object)
-        html = self.html
+        html = self.end_capture(capture)
         js = self.js
-        self._rendering_to = original
         self._rendering_js_to = original_js
         return html, js
 
+    def render_fragment(self, web_object):
+        """
+        Renders the web_object on its own and returns everything that was produced as a picklable dict, so it can
+        be stored and added to a renderer again with append_fragment. Inline styles are left inline, as the css
+        class names are only valid within a single renderer.
+        """
+        capture = self.start_capture()
+        original = self._rendering_js_to, self._css, self.resources
+        original_translate = self.translate_inline_styles_to_classes
+        self._rendering_js_to = []
+        self._css = []
+        self.resources = Resources()
+        self.translate_inline_styles_to_classes = False
+        self.render('', web_object)
+        fragment = {
+            'html': self.end_capture(capture),
+            'js': self._rendering_js_to,
+            'css': self._css,
+            'resources': [(resource.url, resource.type, resource.module, resource.name) for resource in self.resources]
+        }
+        self._rendering_js_to, self._css, self.resources = original
+        self.translate_inline_styles_to_classes = original_translate
+        return fragment
+
+    def append_fragment(self, fragment):
+        """
+        Adds the output of render_fragment as if the web_object was rendered here.
+        """
+        if self.minify:
+            self.append_minified(fragment['html'])
+        elif self.separator and fragment['html'].endswith(self.separator):
+            self.write(fragment['html'][:-len(self.separator)])
+            self._pending = self.separator
+        else:
+            self.write(fragment['html'])
+        self._rendering_js_to.extend(fragment['js'])
+        self._css.extend(fragment['css'])
+        for url, type, module, name in fragment['resources']:
+            self.resources.add_or_replace_resource(url, type, module, name)
+
+    def push_parent(self, parent):
+        self._ancestors.append(parent)
+        for cls in parent.__class__.__mro__:
+            self._ancestors_by_type.setdefault(cls, []).append(parent)
+
+    def pop_parent(self):
+        parent = self._ancestors.pop()
+        for cls in parent.__class__.__mro__:
+            self._ancestors_by_type[cls].pop()
+
+    @property
+    def parent_tree(self):
+        """
+        :return: The Objects that are being rendered, innermost first
+        """
+        return self._ancestors[::-1]
+
     def find_parent(self, type):
-        for parent in self.parent_tree:
-            if isinstance(parent, type):
-                return parent
-        return None
+        """
+        :return: The innermost Object being rendered that is an instance of type (or one of its subclasses), or None
+        """
+        if isinstance(type, tuple):
+            return next((parent for parent in reversed(self._ancestors) if isinstance(parent, type)), None)
+
+        parents = self._ancestors_by_type.get(type)
+        return parents[-1] if parents else None
 
     def add_resource(self, url, type, module, name=''):
         self.resources.add_resource(url, type, module, name)
@@ -140,9 +369,15 @@ class Renderer:
     def replace_resource(self, url, type, module, name=''):
         self.resources.replace_resource(url, type, module, name)
 
+    def _read(self, offset):
+        if not self._sink.seekable:
+            raise ValueError('The html was written to {!r} and can\'t be read back'.format(self._sink.writer))
+        # A trailing line break is left out of minified html
+        return self._sink.read_from(offset) + ('' if self.minify else self._pending)
+
     @property
     def html(self):
-        return ''.join(self._rendering_to)
+        return self._read(0)
 
     @property
     def css(self):
@@ -150,11 +385,11 @@ class Renderer:
         for style, class_name in self._css_classes.items():
             css.append('.' + class_name + '{' + style + '}')
 
-        return '\r\n'.join(css)
+        return ('\n' if self.minify else '\r\n').join(css)
 
     @property
     def js(self):
-        return '\r\n'.join(self._rendering_js_to)
+        return ('\n' if self.minify else '\r\n').join(self._rendering_js_to)
 
     @property
     def css_files(self):
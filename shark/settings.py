@@ -1,10 +1,24 @@
+from django.core.signals import setting_changed
 from django_pluggableappsettings import AppSettings, Setting, IntSetting, StringSetting
 
 
 class SharkSettings(AppSettings):
     SHARK_PAGE_HANDLER = StringSetting('')
     SHARK_USE_STATIC_PAGES = Setting(True)
+    SHARK_STATIC_PAGE_CACHE_TIMEOUT = IntSetting(0)
+    SHARK_STATIC_PAGE_CACHE_STALE_TIMEOUT = IntSetting(0)
     SHARK_GOOGLE_ANALYTICS_CODE = StringSetting('')
+    SHARK_MINIFY_HTML = Setting(False)
+    SHARK_PAGE_STATE_TIMEOUT = IntSetting(24 * 60 * 60)
+    SHARK_BACKGROUND_EXECUTOR = StringSetting('')
+    SHARK_BACKGROUND_WORKERS = IntSetting(4)
+    SHARK_HANDLER_MANIFEST = StringSetting('')
+    SHARK_SITEMAP_CACHE_TIMEOUT = IntSetting(60 * 60)
+    SHARK_PROFILER = Setting(False)
+    SHARK_PROFILER_PANEL = Setting(False)
+    SHARK_PROFILER_HOOK = StringSetting('')
+    SHARK_CODE_VERSION = StringSetting('')
+    SHARK_EVAL_JS = Setting(False)
     CLOUDFLARE_CLIENT_IP_ENABLED = Setting(False)
     PROXY_HOPS = IntSetting(2)
     SHARK_GOOGLE_VERIFICATION = StringSetting('')
@@ -12,4 +26,12 @@ class SharkSettings(AppSettings):
     SHARK_YANDEX_VERIFICATION = StringSetting('')
     SHARK_GOOGLE_BROWSER_API_KEY = StringSetting('')
     SHARK_FACEBOOK_APP_ID = StringSetting('')
-    SHARK_FACEBOOK_SECRET = StringSetting('')
\ No newline at end of file
+    SHARK_FACEBOOK_SECRET = StringSetting('')
+
+
+def reset_setting(setting, **kwargs):
+    # SharkSettings keeps a value once it has been read, override_settings has to remove it
+    SharkSettings._values.pop(setting, None)
+
+
+setting_changed.connect(reset_setting, dispatch_uid='shark_reset_setting')
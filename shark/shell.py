@@ -0,0 +1,140 @@
+import os
+import threading
+
+from django.core.signals import setting_changed
+from django.template.loader import get_template
+from django.templatetags.static import static
+from django.utils.html import conditional_escape
+
+TEMPLATES = ['shark/base.html', 'shark/base_head.html', 'shark/base_tail.html']
+
+ICONS = [
+    ('apple-touch-icon', '57x57', 'icons/apple-icon-57x57.png'),
+    ('apple-touch-icon', '60x60', 'icons/apple-icon-60x60.png'),
+    ('apple-touch-icon', '72x72', 'icons/apple-icon-72x72.png'),
+    ('apple-touch-icon', '76x76', 'icons/apple-icon-76x76.png'),
+    ('apple-touch-icon', '114x114', 'icons/apple-icon-114x114.png'),
+    ('apple-touch-icon', '120x120', 'icons/apple-icon-120x120.png'),
+    ('apple-touch-icon', '144x144', 'icons/apple-icon-144x144.png'),
+    ('apple-touch-icon', '152x152', 'icons/apple-icon-152x152.png'),
+    ('apple-touch-icon', '180x180', 'icons/apple-icon-180x180.png'),
+]
+
+FAVICONS = [
+    ('192x192', 'icons/android-icon-192x192.png'),
+    ('32x32', 'icons/favicon-32x32.png'),
+    ('96x96', 'icons/favicon-96x96.png'),
+    ('16x16', 'icons/favicon-16x16.png'),
+]
+
+
+def static_url(path):
+    return conditional_escape(static(path))
+
+
+class PageShell(object):
+    """
+    Builds the html around the content of a page, the same html as the shark/base.html, shark/base_head.html and
+    shark/base_tail.html templates. The parts that are the same for every page, like the icon links with their
+    static urls, are built once and the page is put together by joining strings.
+    """
+    def __init__(self):
+        links = ['        <link rel="{}" sizes="{}" href="{}">'.format(rel, sizes, static_url(path))
+                 for rel, sizes, path in ICONS]
+        links.extend(['        <link rel="icon" type="image/png" sizes="{}"{}href="{}">'.format(
+            sizes, '  ' if sizes == '192x192' else ' ', static_url(path)) for sizes, path in FAVICONS])
+        links.append('        <link rel="manifest" href="{}">'.format(static_url('icons/manifest.json')))
+        links.append('        <meta name="msapplication-TileColor" content="#ffffff">')
+        links.append('        <meta name="msapplication-TileImage" content="{}">'.format(
+            static_url('icons/ms-icon-144x144.png')))
+        links.append('        <meta name="theme-color" content="#ffffff">')
+
+        self.head_start = '<!DOCTYPE html>\n<html lang="en">\n    <head>'
+        self.meta = ('\n        <meta charset="utf-8">'
+                     '\n        <meta http-equiv="X-UA-Compatible" content="IE=edge">'
+                     '\n        <meta name="viewport" content="width=device-width, initial-scale=1">')
+        self.icons = '\n' + '\n'.join(links) + '\n'
+        self.scripts = ('        <script src="https://ajax.googleapis.com/ajax/libs/jquery/1.12.0/jquery.min.js"></script>'
+                        '\n        <script src="https://maxcdn.bootstrapcdn.com/bootstrap/3.3.6/js/bootstrap.min.js"></script>'
+                        '\n        <script src="{}"></script>'.format(static_url('shark/js/base.js')))
+        self.tail_end = '\n        </script>\n    </body>\n</html>\n'
+
+    def head(self, context):
+        parts = [self.head_start]
+        if context.get('title'):
+            parts.append('\n        <title>{}</title>\n'.format(conditional_escape(context['title'])))
+        parts.append(self.meta)
+        if context.get('description'):
+            parts.append('\n        <meta name="description" content="{}">\n'.format(
+                conditional_escape(context['description'])))
+        if context.get('keywords'):
+            parts.append('        <meta name="keywords" content="{}">\n'.format(conditional_escape(context['keywords'])))
+        if context.get('author'):
+            parts.append('        <meta name="author" content="{}">\n'.format(conditional_escape(context['author'])))
+        if context.get('extra_meta'):
+            parts.append(context['extra_meta'] + '\n')
+        parts.append(self.icons)
+        parts.append(context.get('extra_css', ''))
+        if context.get('css'):
+            parts.append('\n        <style>\n' + context['css'] + '\n        </style>')
+        parts.append('\n    </head>\n    <body>\n')
+        if context.get('gtm_code'):
+            parts.append(context['gtm_code'])
+        parts.append('\n')
+        return ''.join(parts)
+
+    def tail(self, context):
+        parts = ['\n']
+        if context.get('tail_css'):
+            parts.append(context['tail_css'] + '\n')
+        parts.append(self.scripts)
+        if context.get('extra_js'):
+            parts.append('\n' + context['extra_js'])
+        parts.append('\n        <script type="text/javascript">')
+        if context.get('javascript'):
+            parts.append('\n            ' + context['javascript'])
+        parts.append('\n            var csrf_token = getCookie(\'csrftoken\');'
+                     '\n            var page_token = "{}";'.format(conditional_escape(context.get('page_token', ''))))
+        if context.get('push_url'):
+            parts.append('\n            connect_push("{}");'.format(conditional_escape(context['push_url'])))
+        parts.append(self.tail_end)
+        return ''.join(parts)
+
+    def page(self, context):
+        return self.head(context) + context.get('modals', '') + context.get('content', '') + self.tail(context)
+
+
+_shell = None
+_shell_lock = threading.Lock()
+
+
+def templates_overridden():
+    """
+    :return: Whether a project template replaces one of the base templates of shark
+    """
+    shark_templates = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+    for name in TEMPLATES:
+        origin = get_template(name).origin
+        if not os.path.abspath(origin.name).startswith(shark_templates + os.sep):
+            return True
+    return False
+
+
+def page_shell():
+    """
+    :return: The PageShell of this process, or None if the base templates are overridden and have to be rendered
+    """
+    global _shell
+    with _shell_lock:
+        if _shell is None:
+            _shell = False if templates_overridden() else PageShell()
+    return _shell or None
+
+
+def reset_page_shell(**kwargs):
+    global _shell
+    with _shell_lock:
+        _shell = None
+
+
+setting_changed.connect(reset_page_shell, dispatch_uid='shark_reset_page_shell')
@@ -1,6 +1,6 @@
 function send_action(post_data) {
     post_data.csrfmiddlewaretoken = csrf_token;
-    post_data.keep_variables = keep_variables;
+    post_data.page_token = page_token;
 
     $.ajax({
         type: 'POST',
@@ -9,15 +9,181 @@ function send_action(post_data) {
         dataType: 'json',
 
         success: function(data, status) {
-            eval(data.javascript);
+            apply_commands(data.commands);
             bind_forms();
         }
     });
 }
 
+function poll_job(job_id, wait) {
+    // Asks for the progress of a background action, and its result when it's done
+    setTimeout(function() {
+        $.ajax({
+            type: 'POST',
+            url: window.location.href,
+            data: {csrfmiddlewaretoken: csrf_token, job: job_id},
+            dataType: 'json',
+
+            success: function(data, status) {
+                apply_commands(data.commands);
+                bind_forms();
+            }
+        });
+    }, wait);
+}
+
+// The nonce of this script, given to the scripts loaded by run-script for a Content Security Policy with nonces
+var script_nonce = document.currentScript ? document.currentScript.nonce || '' : '';
+
+function apply_commands(commands, start) {
+    // Applies the commands in the reply to an action, in order. Commands after an animation wait for it to finish.
+    for (var i = start || 0; i < commands.length; i++) {
+        var command = commands[i];
+        switch (command[0]) {
+            case 'run-script':
+                // Javascript is loaded as a script from the site, the commands after it wait for it to run
+                var script = document.createElement('script');
+                var resume = i + 1;
+                script.src = command[1];
+                script.nonce = script_nonce;
+                script.onload = script.onerror = function() {
+                    $(this).remove();
+                    apply_commands(commands, resume);
+                };
+                document.head.appendChild(script);
+                return;
+            case 'run-js':
+                // Only sent with SHARK_EVAL_JS, as eval isn't allowed by a Content Security Policy without
+                // 'unsafe-eval'
+                $.globalEval(command[1]);
+                break;
+            case 'action':
+                do_action(command[1], command[2]);
+                break;
+            case 'replace-resource':
+                $(command[1]).remove();
+                $('<link rel="stylesheet" type="text/css" />').attr({id: command[1].substr(1), href: command[2]})
+                    .appendTo('head');
+                break;
+            case 'redirect':
+                window.location = command[1];
+                return;
+            case 'replace-html':
+                $(command[1]).html(command[2]);
+                break;
+            case 'append':
+                $(command[1]).append(command[2]);
+                break;
+            case 'set-attr':
+                $(command[1]).attr(command[2], command[3]);
+                break;
+            case 'set-val':
+                $(command[1]).val(command[2]);
+                break;
+            case 'show':
+                $(command[1]).show();
+                break;
+            case 'hide':
+                $(command[1]).hide();
+                break;
+            case 'progress':
+                $(document).trigger('shark:progress', command.slice(1));
+                break;
+            case 'poll':
+                poll_job(command[1], command[2]);
+                break;
+            case 'fade-in':
+            case 'fade-out':
+            case 'animate':
+                var element = $(command[1]);
+                if (command[0] == 'fade-in') {
+                    element.fadeIn(400);
+                } else if (command[0] == 'fade-out') {
+                    element.fadeOut(400);
+                } else {
+                    element.animate(command[2]);
+                }
+                var next = i + 1;
+                element.promise().done(function() {
+                    apply_commands(commands, next);
+                });
+                return;
+        }
+    }
+}
+
+// Actions issued in the same tick are sent together in one request
+var queued_actions = [];
+var queued_timer = null;
+
 function do_action(action, post_data) {
-    post_data.action = action;
-    send_action(post_data);
+    // Calling an action again with the same arguments before the actions are sent only sends it once. Requests that
+    // were sent are never aborted, the server may already have run their actions.
+    var key = JSON.stringify([action, post_data]);
+    queued_actions = $.grep(queued_actions, function(queued) {
+        return JSON.stringify(queued) != key;
+    });
+    queued_actions.push([action, post_data]);
+
+    if (queued_timer === null) {
+        queued_timer = setTimeout(send_actions, 0);
+    }
+}
+
+function send_actions() {
+    var actions = queued_actions;
+    queued_actions = [];
+    queued_timer = null;
+
+    $.ajax({
+        type: 'POST',
+        url: window.location.href,
+        data: {
+            csrfmiddlewaretoken: csrf_token,
+            page_token: page_token,
+            actions: JSON.stringify(actions)
+        },
+        dataType: 'json',
+
+        success: function(data, status) {
+            apply_commands(data.commands);
+            bind_forms();
+        }
+    });
+}
+
+function connect_push(push_url) {
+    // Applies the updates sent to this page with shark.push.PageChannel
+    var url = push_url + '?token=' + encodeURIComponent(page_token);
+    if (window.EventSource) {
+        var source = new EventSource(url);
+        source.onmessage = function(event) {
+            apply_commands(JSON.parse(event.data));
+            bind_forms();
+        };
+    } else {
+        long_poll_push(url, 0);
+    }
+}
+
+function long_poll_push(url, after) {
+    $.ajax({
+        url: url + '&poll=1&after=' + after,
+        dataType: 'json',
+
+        success: function(data, status) {
+            $.each(data.messages, function(i, commands) {
+                apply_commands(commands);
+            });
+            bind_forms();
+            long_poll_push(url, data.after);
+        },
+        error: function() {
+            setTimeout(function() {
+                long_poll_push(url, after);
+            }, 5000);
+        }
+    });
 }
 
 function getCookie(name) {
@@ -46,7 +212,7 @@ function bind_forms() {
             processData: false,
             contentType: false,
             success: function(data, status) {
-                eval(data.javascript);
+                apply_commands(data.commands);
                 bind_forms();
             }
         } );
@@ -54,7 +220,7 @@ function bind_forms() {
     });
 
     $('form[data-async]').each(function() {
-        $('<input type="hidden" name="keep_variables">').attr('value', keep_variables).appendTo(this);
+        $('<input type="hidden" name="page_token">').attr('value', page_token).appendTo(this);
         $('<input type="hidden" name="csrfmiddlewaretoken">').attr('value', csrf_token).appendTo(this)
         $(this).removeAttr('data-async')
     })
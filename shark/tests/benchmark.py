@@ -0,0 +1,115 @@
+"""
+Measures the cost of creating and rendering Shark Objects. Run with:
+
+    python -m shark.tests.benchmark
+"""
+import os
+import tracemalloc
+from timeit import repeat
+
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        INSTALLED_APPS=['django.contrib.staticfiles'],
+        TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'DIRS': [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')]
+        }],
+        STATIC_URL='/static/'
+    )
+    django.setup()
+
+from django.template.loader import render_to_string
+
+from shark.base import Object, Objects, Default, StringParam, Text
+from shark.objects.tables import TableColumn, Table, TableRow
+from shark.objects.text import Anchor, Br
+from shark.param_converters import ObjectsParam, IntegerParam
+from shark.renderer import Renderer
+from shark.shell import page_shell
+
+
+class ParamTableColumn(Object):
+    """
+    TableColumn as it was written before parameters were declared, to compare against.
+    """
+    def __init__(self, items=Default, colspan=0, rowspan=0, align='', **kwargs):
+        self.init(kwargs)
+        self.items = self.param(items, ObjectsParam, 'Content of the column', Objects())
+        self.colspan = self.param(colspan, IntegerParam, 'Span number of columns')
+        self.rowspan = self.param(rowspan, IntegerParam, 'Span number of rows')
+        self.align = self.param(align, StringParam, 'Align left, right or center')
+
+        if self.colspan:
+            self.add_attribute('colspan', self.colspan)
+        if self.rowspan:
+            self.add_attribute('rowspan', self.rowspan)
+        if self.align:
+            self.add_style('text-align: {};'.format(self.align))
+
+
+def report(name, function, number):
+    seconds = min(repeat(function, number=number, repeat=5))
+    print('{:<30} {:>8.2f} us'.format(name, seconds / number * 1000000))
+
+
+def report_memory(name, function, number, per=1):
+    tracemalloc.start()
+    objects = [function() for i in range(number)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('{:<30} {:>8.0f} bytes'.format(name, size / number / per))
+    return objects
+
+
+def table(rows=1000, columns=10):
+    return Table(rows=[TableRow([TableColumn(Text('cell')) for column in range(columns)]) for row in range(rows)])
+
+
+def page_context():
+    renderer = Renderer()
+    renderer.render('        ', table(20, 5))
+    return {
+        'title': 'Benchmark',
+        'description': 'A page with a table',
+        'keywords': 'shark, benchmark',
+        'author': '',
+        'extra_meta': '',
+        'gtm_code': '',
+        'page_token': 'abcdefghijkl:signature',
+        'push_url': '',
+        'content': renderer.html,
+        'extra_css': '',
+        'extra_js': '',
+        'javascript': '$(".table").show();',
+        'css': ''
+    }
+
+
+def main(number=20000):
+    print('Creating objects, per object:')
+    report('Text', lambda: Text('Hello'), number)
+    report('Anchor', lambda: Anchor('Link', '/page/'), number)
+    report('TableColumn', lambda: TableColumn('cell', align='left'), number)
+    report('TableColumn with self.param', lambda: ParamTableColumn('cell', align='left'), number)
+
+    print('Memory, per object:')
+    report_memory('Text', lambda: Text('Hello'), number)
+    report_memory('Br', Br, number)
+    report_memory('TableColumn', lambda: TableColumn('cell'), number)
+    report_memory('1000x10 table, per cell', table, 1, 10000)
+
+    print('Rendering a 1000x10 table, per table:')
+    report('Create', table, 10)
+    report('Render', lambda: Renderer().render('', table()), 10)
+
+    print('Page around the content, per page:')
+    context = page_context()
+    report('shark/base.html template', lambda: render_to_string('shark/base.html', context), 2000)
+    report('PageShell', lambda: page_shell().page(context), 2000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+"""
+Views of an app with an import that fails, the error must not be hidden by the handler discovery.
+"""
+from .missing import MissingPage
@@ -0,0 +1,6 @@
+"""
+The urls of urls.py under /prefix/, to test that urls are reversed again when the urlconf changes.
+"""
+from django.conf.urls import url, include
+
+urlpatterns = [url(r'^prefix/', include('shark.tests.urls'))]
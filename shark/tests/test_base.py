@@ -1,10 +1,16 @@
+import io
 from unittest import TestCase
 from unittest import main
 
-from shark.base import Enumeration, StringParam, Object, Objects, Text
+from shark.actions import jq_by_id, JQ, Action, URL
+from shark.base import Enumeration, StringParam, Object, Objects, Text, Param, IdScope
+from shark.cache import track_dependencies, add_dependency, etag_matches, not_modified
 from shark.common import Default
+from shark.jobs import ImmediateExecutor
+from shark.objects.caching import Cached
 from shark.param_converters import ObjectsParam
-from shark.renderer import Renderer
+from shark.profiler import RenderProfiler, profile_phase
+from shark.renderer import Renderer, WriterSink
 
 
 class MyEnumaration(Enumeration):
@@ -32,6 +38,25 @@ class TestEnumeration(TestCase):
     def test_names(self):
         self.assertEqual(list(MyEnumaration.names()), ['first', 'second', 'last'], 'Names incorrect')
 
+    def test_inherited(self):
+        class MoreEnumeration(MyEnumaration):
+            extra = 4
+
+        self.assertEqual(list(MoreEnumeration.names()), ['first', 'second', 'last', 'extra'])
+        self.assertEqual(list(MyEnumaration.names()), ['first', 'second', 'last'])
+
+        MoreEnumeration.added = 5
+        self.assertEqual(MoreEnumeration.name(5), 'added')
+
+        class Counted(object):
+            counter = 0
+
+        class CountedEnumeration(Counted, MyEnumaration):
+            pass
+
+        CountedEnumeration.counter += 1
+        self.assertNotIn('counter', CountedEnumeration.str_map)
+
     def test_From_str(self):
         self.assertEqual(MyEnumaration.from_str('second'), 2, 'From_str failed')
         with self.assertRaises(ValueError, msg='Invalid string lookup does not raise ValueError'):
@@ -130,6 +155,40 @@ class SimpleObject(Object):
         renderer.append('Test')
 
 
+class SimpleBlock(Object):
+    def __init__(self, items=None, **kwargs):
+        self.init(kwargs)
+        self.items = self.param(items, ObjectsParam, 'Items')
+
+    def get_html(self, renderer):
+        renderer.append('<div>')
+        renderer.render('    ', self.items)
+        renderer.append('</div>')
+
+
+class SimpleLink(Object):
+    def __init__(self, text='', **kwargs):
+        self.init(kwargs)
+        self.text = text
+
+    def get_html(self, renderer):
+        renderer.append('<a href="#">')
+        renderer.inline_render(self.text)
+        renderer.append('</a>')
+
+
+class DeclaredObject(Object):
+    parameters = [
+        Param('text', StringParam, 'Text', 'default'),
+        Param('items', ObjectsParam, 'Items', None),
+        Param('extra', StringParam, 'Detect whether it was passed', Default)
+    ]
+
+    def __init__(self, text=Default, items=None, extra=Default, **kwargs):
+        self.init(kwargs)
+        self.set_parameters(text, items, extra)
+
+
 class TestObject(TestCase):
     def test_id(self):
         obj = SimpleObject()
@@ -148,6 +207,20 @@ class TestObject(TestCase):
         self.assertEqual(obj3.id, 'SimpleObject_2')
         self.assertEqual(obj3._id, 'SimpleObject_2')
 
+    def test_id_scope(self):
+        SimpleObject().id
+        with IdScope():
+            self.assertEqual(SimpleObject().id, 'SimpleObject_1')
+            with IdScope('fragment_'):
+                self.assertEqual(SimpleObject().id, 'fragment_SimpleObject_1')
+            self.assertEqual(SimpleObject().id, 'SimpleObject_2')
+
+        with IdScope() as scope:
+            self.assertEqual(SimpleObject().id, 'SimpleObject_1')
+
+        ids = list(scope.iterate(SimpleObject().id for i in range(2)))
+        self.assertEqual(ids, ['SimpleObject_2', 'SimpleObject_3'])
+
     def test_param(self):
         obj = SimpleObject()
         self.assertEqual(obj.param(3, StringParam, 'Description'), '3')
@@ -156,6 +229,35 @@ class TestObject(TestCase):
         with self.assertRaises(TypeError):
             obj.param(3, 'string', 'Description')
 
+    def test_parameters(self):
+        obj = DeclaredObject()
+        self.assertEqual(obj.text, 'default')
+        self.assertEqual(obj.items, Objects())
+        self.assertIs(obj.items._parent, obj)
+        self.assertIs(obj.extra, Default)
+        self.assertIsNot(DeclaredObject().items, obj.items)
+
+        obj = DeclaredObject('<b>', 'item', 'passed')
+        self.assertEqual(obj.text, '&lt;b&gt;')
+        self.assertEqual(len(obj.items), 1)
+        self.assertEqual(obj.extra, 'passed')
+
+        self.assertRaises(TypeError, Param, 'text', str)
+
+    def test_slots(self):
+        text = Text('Small')
+        self.assertFalse(hasattr(text, '__dict__'))
+        self.assertIsNone(text._attribute_dict)
+
+        text = Text('Styled', style='color: red;')
+        self.assertEqual(text._attributes, {'style': 'color: red;'})
+
+        obj = SimpleObject()
+        obj.anything = 'Subclasses without __slots__ can still add attributes'
+        self.assertEqual(obj.base_attributes, '')
+        obj.add_class('big')
+        self.assertEqual(obj.base_attributes, ' class="big"')
+
     def test_get_html(self):
         obj = SimpleObject()
         renderer = Renderer()
@@ -222,6 +324,238 @@ class TestRenderer(TestCase):
         print(renderer.css_files)
         print(renderer.css_resources)
 
+    def test_render_chunks(self):
+        content = Objects([Text('First'), Objects([Text('Second'), Text('Third')])])
+        renderer = Renderer()
+        renderer.render('    ', content)
+
+        chunks = list(Renderer().render_chunks('    ', content))
+        self.assertEqual(chunks, ['    First\r\n', '    Second\r\n', '    Third\r\n'])
+        self.assertEqual(''.join(chunks), renderer.html)
+
+    def test_fragment(self):
+        renderer = Renderer()
+        fragment = renderer.render_fragment(Text('Cached'))
+        self.assertEqual(renderer.html, '')
+        self.assertEqual(fragment['html'], 'Cached\r\n')
+
+        renderer.append_fragment(fragment)
+        renderer.append_fragment(fragment)
+        self.assertEqual(renderer.html, 'Cached\r\nCached\r\n')
+
+    def test_cached_needs_key(self):
+        # Fragments without a key would all share the same output
+        with self.assertRaises(TypeError):
+            Cached(items=Text('First'))
+        with self.assertRaises(ValueError):
+            Cached('', Text('First'))
+
+    def test_find_parent(self):
+        found = []
+
+        class Probe(Object):
+            def __init__(self, **kwargs):
+                self.init(kwargs)
+
+            def get_html(self, renderer):
+                found.append((renderer.find_parent(SimpleBlock), renderer.find_parent(SimpleLink),
+                              renderer.find_parent(Object), renderer.parent_tree))
+
+        probe = Probe()
+        inner = SimpleBlock(probe)
+        outer = SimpleBlock(inner)
+        renderer = Renderer()
+        renderer.render('', outer)
+
+        self.assertEqual(found, [(inner, None, inner, [inner, inner, outer, outer])])
+        self.assertEqual(renderer.parent_tree, [])
+        self.assertIsNone(renderer.find_parent(SimpleBlock))
+
+    def test_sinks(self):
+        content = SimpleBlock([Text('Tést'), SimpleLink('more')])
+        expected = Renderer().render_string(content)
+
+        renderer = Renderer(output=io.BytesIO())
+        renderer.render('', content)
+        self.assertEqual(renderer.html, expected)
+        self.assertEqual(renderer.render_string(SimpleLink('Inline')), '<a href="#">Inline</a>\r\n')
+        self.assertEqual(renderer.html, expected)
+
+        output = io.BytesIO()
+        renderer = Renderer(output=WriterSink(output))
+        renderer.render('', content)
+        self.assertEqual(renderer.render_string_and_js(SimpleLink('Inline'))[0], '<a href="#">Inline</a>')
+        renderer.render('', Text('End'))
+        self.assertEqual(renderer.flush(), '')
+        self.assertEqual(output.getvalue().decode('utf-8'), expected + 'End\r\n')
+
+    def test_minify(self):
+        content = SimpleBlock([Text('Read'), SimpleLink('more'), SimpleLink('or less'), SimpleBlock(Text('Done'))])
+        renderer = Renderer()
+        renderer.render('    ', content)
+        self.assertEqual(renderer.html, '    <div>\r\n        Read\r\n        <a href="#">more</a>\r\n'
+                                        '        <a href="#">or less</a>\r\n        <div>\r\n            Done\r\n'
+                                        '        </div>\r\n    </div>\r\n')
+
+        renderer = Renderer(minify=True)
+        renderer.render('    ', content)
+        self.assertEqual(renderer.html, '<div>Read\n<a href="#">more</a>\n<a href="#">or less</a><div>Done</div></div>')
+        self.assertEqual(renderer.render_string(SimpleLink('Inline')), '<a href="#">Inline</a>')
+        self.assertEqual(renderer.render_string_and_js(Objects([Text('Two '), SimpleLink('parts')]))[0],
+                         'Two <a href="#">parts</a>')
+
+
+class StyleSheet:
+    def __init__(self, module, name, url):
+        self.resource = type('Resource', (), {'module': module})
+        self.name = name
+        self.url = url
+
+
+class TestCommands(TestCase):
+    def test_commands(self):
+        renderer = Renderer()
+        jq = Action('save', id=1) + jq_by_id('box').hide().attr('title', 'Box').html(SimpleLink('Go')).fadeIn() + \
+            URL('/done')
+        self.assertEqual(jq.commands(renderer), [
+            ['action', 'save', {'id': 1}],
+            ['hide', '#box'],
+            ['set-attr', '#box', 'title', 'Box'],
+            ['replace-html', '#box', '<a href="#">Go</a>'],
+            ['fade-in', '#box'],
+            ['redirect', '/done']
+        ])
+
+        jq = JQ('$(".boxes")').show()
+        self.assertEqual(jq.commands(renderer), [['show', '.boxes']])
+
+    def test_combined_commands(self):
+        renderer = Renderer()
+        jq = JQ('$(".boxes")').show().attr('title', 'Box') + jq_by_id('x').hide()
+        self.assertEqual(jq.commands(renderer), [
+            ['show', '.boxes'],
+            ['set-attr', '.boxes', 'title', 'Box'],
+            ['hide', '#x']
+        ])
+
+        jq = JQ("$('.boxes')").html(SimpleLink('Go')) + jq_by_id('x').show()
+        self.assertEqual(jq.commands(renderer), [
+            ['replace-html', '.boxes', '<a href="#">Go</a>'],
+            ['show', '#x']
+        ])
+
+    def test_replace_resource(self):
+        renderer = Renderer()
+        jq = JQ('$("head")').replace_resource(StyleSheet('shark', 'theme', '/static/theme.css'))
+        self.assertEqual(jq.commands(renderer), [['replace-resource', '#resource-shark-theme', '/static/theme.css']])
+        self.assertEqual(jq.js(renderer), '$("#resource-shark-theme").remove();$("head").append("<link '
+                                          'id=\'resource-shark-theme\' rel=\'stylesheet\' href=\'/static/theme.css\' '
+                                          'type=\'text/css\' />");')
+
+    def test_html_variables(self):
+        # The html is only put in a variable with a function for the javascript
+        renderer = Renderer()
+        jq = jq_by_id('box').html(SimpleLink('Go'))
+        jq.commands(renderer)
+        self.assertIsNone(jq._variable_dict)
+        self.assertEqual(renderer.js, '')
+
+        with IdScope():
+            jq = jq_by_id('box').html(SimpleLink('Go'))
+            js = jq.js(renderer)
+        variable = jq.id.lower() + '_1'
+        self.assertEqual(js, '$("#box").html({0});func_{0}();'.format(variable))
+        self.assertIn('var {} = '.format(variable), renderer.js)
+
+
+class TestJobs(TestCase):
+    def test_immediate_executor(self):
+        executor = ImmediateExecutor()
+        self.assertEqual(executor.submit(lambda a, b: a + b, 1, b=2).result(), 3)
+        self.assertIsInstance(executor.submit(int, 'x').exception(), ValueError)
+
+
+class FailingObject(Object):
+    def __init__(self, **kwargs):
+        self.init(kwargs)
+
+    def get_html(self, renderer):
+        raise ValueError('Failed')
+
+
+class ProfiledHandler:
+    def __init__(self):
+        self.text = ''
+        self.profiler = RenderProfiler()
+
+
+class TestProfiler(TestCase):
+    def test_classes(self):
+        handler = ProfiledHandler()
+        Renderer(handler).render('', SimpleBlock([SimpleObject(), SimpleObject()]))
+
+        classes = {stats.name: stats for stats in handler.profiler.top_classes()}
+        self.assertEqual(classes['SimpleBlock'].count, 1)
+        self.assertEqual(classes['SimpleObject'].count, 2)
+        self.assertGreaterEqual(classes['SimpleBlock'].cumulative, classes['SimpleBlock'].own)
+
+    def test_failed_render(self):
+        handler = ProfiledHandler()
+        with self.assertRaises(ValueError):
+            Renderer(handler).render('', SimpleBlock([FailingObject()]))
+
+        self.assertEqual(handler.profiler._child_time, [])
+        self.assertEqual({stats.name for stats in handler.profiler.top_classes()}, {'Objects', 'SimpleBlock', 'FailingObject'})
+
+    def test_server_timing(self):
+        profiler = RenderProfiler()
+        with profile_phase(profiler, 'render'):
+            pass
+        profiler.add_phase('template', 0.0015)
+        profiler.add_phase('template', 0.0005)
+        self.assertRegex(profiler.server_timing(), r'^render;dur=\d+\.\d\d, template;dur=2\.00$')
+
+
+class FakeModel:
+    class _meta:
+        label_lower = 'tests.fakemodel'
+
+
+class TestDependencies(TestCase):
+    def test_track_dependencies(self):
+        add_dependency(FakeModel, 1)
+        with track_dependencies() as outer:
+            add_dependency(FakeModel, 1)
+            with track_dependencies() as inner:
+                add_dependency(FakeModel)
+
+        self.assertEqual(inner, {('tests.fakemodel', None)})
+        self.assertEqual(outer, {('tests.fakemodel', '1'), ('tests.fakemodel', None)})
+
+
+class FakeRequest:
+    def __init__(self, method='GET', **meta):
+        self.method = method
+        self.META = meta
+
+
+class TestConditionalGet(TestCase):
+    def test_etag_matches(self):
+        self.assertTrue(etag_matches('"abc"', '"abc"'))
+        self.assertTrue(etag_matches('"abc"', '"xyz", W/"abc"'))
+        self.assertTrue(etag_matches('"abc"', '*'))
+        self.assertFalse(etag_matches('"abc"', '"xyz"'))
+
+    def test_not_modified(self):
+        self.assertTrue(not_modified(FakeRequest(HTTP_IF_NONE_MATCH='"abc"'), '"abc"'))
+        self.assertFalse(not_modified(FakeRequest('POST', HTTP_IF_NONE_MATCH='"abc"'), '"abc"'))
+        self.assertFalse(not_modified(FakeRequest(HTTP_IF_NONE_MATCH='"xyz"'), '"abc"', 0))
+
+        since = 'Sat, 01 Jan 2000 00:00:00 GMT'
+        self.assertTrue(not_modified(FakeRequest(HTTP_IF_MODIFIED_SINCE=since), None, 946684800))
+        self.assertFalse(not_modified(FakeRequest(HTTP_IF_MODIFIED_SINCE=since), None, 946684801))
+        self.assertFalse(not_modified(FakeRequest(), '"abc"', 946684800))
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
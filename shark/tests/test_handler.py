@@ -0,0 +1,605 @@
+"""
+Tests that need Django. Run them with the test runner of a project that has shark installed, or on their own, in
+which case they set up Django with an in-memory database.
+"""
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        SECRET_KEY='shark-tests',
+        INSTALLED_APPS=['django.contrib.auth', 'django.contrib.contenttypes', 'django.contrib.sessions',
+                        'django.contrib.staticfiles', 'shark'],
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        MIDDLEWARE=['django.contrib.sessions.middleware.SessionMiddleware',
+                    'django.contrib.auth.middleware.AuthenticationMiddleware'],
+        TEMPLATES=[{'BACKEND': 'django.template.backends.django.DjangoTemplates', 'APP_DIRS': True}],
+        ROOT_URLCONF='shark.tests.urls',
+        STATIC_URL='/static/',
+        ALLOWED_HOSTS=['*']
+    )
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.core.urlresolvers import set_script_prefix
+from django.template.loader import render_to_string
+from django.test import TestCase, override_settings, modify_settings
+from django.utils import translation
+
+from shark import cache as shark_cache, handler, jobs, profiler, push
+from shark.cache import track_dependencies, add_dependency, dependency_versions, versions_current, invalidate, \
+    page_cache_key, CacheVary, page_state_key, load_page_state, make_page_token
+from shark.management.commands import shark_export
+from shark.handler import StaticPage as StaticPageHandler
+from shark.models import EditableText, StaticPage
+from shark.objects.tables import create_table
+from shark.renderer import Renderer
+from shark.settings import SharkSettings
+from shark.shell import PageShell, page_shell
+from shark.tests.urls import LanguagePage, PROFILES, TextPage, VersionedPage
+from shark.urls import discover_handlers, get_handlers, load_handler_manifest, write_handler_manifest
+
+
+@override_settings(ROOT_URLCONF='shark.tests.urls')
+class SharkTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def temp_dir(self):
+        """
+        :return: A directory that's removed after the test
+        """
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        return path
+
+    @staticmethod
+    def page_token(response):
+        return response.content.decode().split('var page_token = "')[1].split('"')[0]
+
+
+class TestDependencyVersions(SharkTestCase):
+    def test_versions(self):
+        with track_dependencies() as dependencies:
+            add_dependency(StaticPage, 'about')
+        versions = dependency_versions(dependencies)
+        self.assertTrue(versions_current(versions))
+
+        invalidate(StaticPage, 'contact')
+        self.assertTrue(versions_current(versions))
+        invalidate(StaticPage, 'about')
+        self.assertFalse(versions_current(versions))
+
+    def test_table_versions(self):
+        with track_dependencies() as dependencies:
+            add_dependency(StaticPage)
+        versions = dependency_versions(dependencies)
+
+        invalidate(StaticPage, 'about')
+        self.assertFalse(versions_current(versions))
+
+    def test_evicted_version(self):
+        with track_dependencies() as dependencies:
+            add_dependency(StaticPage, 'about')
+        versions = dependency_versions(dependencies)
+
+        cache.clear()
+        self.assertFalse(versions_current(versions))
+        self.assertNotEqual(dependency_versions(dependencies), versions)
+
+    def test_tracked_models(self):
+        self.assertIn(StaticPage, shark_cache._tracked_models)
+        self.assertIn(EditableText, shark_cache._tracked_models)
+
+
+class TestPageInvalidation(SharkTestCase):
+    def test_cached_page(self):
+        self.assertContains(self.client.get('/text/'), 'Hello')
+
+        text = EditableText.objects.get(name='greeting')
+        text.content = 'Changed'
+        text.save()
+        self.assertContains(self.client.get('/text/'), 'Changed')
+
+    def test_cached_fragment(self):
+        self.assertContains(self.client.get('/text/'), 'Fragment')
+
+        text = EditableText.objects.get(name='fragment')
+        text.content = 'New fragment'
+        text.save()
+        self.assertContains(self.client.get('/text/'), 'New fragment')
+
+
+class TestCachedPage(SharkTestCase):
+    def test_query_string(self):
+        self.assertContains(self.client.get('/search/', {'q': 'first'}), 'Results for first')
+        self.assertContains(self.client.get('/search/', {'q': 'second'}), 'Results for second')
+
+    def test_state_on_cache_hit(self):
+        token = self.page_token(self.client.get('/search/'))
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.assertEqual(self.page_token(self.client.get('/search/')), token)
+        self.assertEqual(cache_set.call_count, 0)
+
+        # State that went missing is stored again
+        cache.delete(page_state_key(token))
+        self.client.get('/search/')
+        self.assertIsNotNone(load_page_state(token))
+
+
+class TestStalePage(SharkTestCase):
+    def expire(self, key):
+        page = cache.get(key)
+        page['expires'] = 0
+        cache.set(key, page)
+
+    def wait_for_refresh(self, key):
+        deadline = time.time() + 5
+        while cache.get(key + ':lock') and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_refresh_in_request_language(self):
+        with translation.override('nl'):
+            key = page_cache_key(LanguagePage.get_unique_name(), [CacheVary.language], None, (), {})
+            self.assertContains(self.client.get('/language/'), 'Language: nl')
+            self.expire(key)
+
+            # The expired page is served while it's rendered again in another thread
+            self.assertContains(self.client.get('/language/'), 'Language: nl')
+            self.wait_for_refresh(key)
+
+        page = cache.get(key)
+        self.assertGreater(page['expires'], time.time())
+        self.assertIn(b'Language: nl', page['content'])
+
+    def test_wait_for_other_worker(self):
+        key = page_cache_key(LanguagePage.get_unique_name(), [CacheVary.language], None, (), {})
+        # Another worker took the lock and never finishes
+        cache.add(key + ':lock', 1, shark_cache.RENDER_LOCK_TIMEOUT)
+        with mock.patch.object(shark_cache, 'RENDER_WAIT_TIMEOUT', 0.1):
+            started = time.time()
+            self.assertContains(self.client.get('/language/'), 'Language:')
+            self.assertLess(time.time() - started, 1)
+
+
+@override_settings(SHARK_PROFILER_HOOK='shark.tests.urls.profile_hook')
+class TestProfiler(SharkTestCase):
+    def setUp(self):
+        super().setUp()
+        PROFILES.clear()
+
+    def test_server_timing(self):
+        response = self.client.get('/profiled/')
+        timings = [timing.split(';')[0] for timing in response['Server-Timing'].split(', ')]
+        self.assertEqual(timings[:4], ['init', 'render_page', 'render', 'template'])
+        self.assertIn('obj-Heading', timings)
+        self.assertEqual(len(PROFILES), 1)
+
+    def test_failed_render(self):
+        with self.assertRaises(ValueError):
+            self.client.get('/profiled/', {'fail': 1})
+
+        self.assertEqual(len(PROFILES), 1)
+        self.assertIn('render_page', PROFILES[0].phases)
+
+    def test_hook_resolved_once(self):
+        self.client.get('/profiled/')
+        with mock.patch.object(profiler, 'import_module') as import_module:
+            self.client.get('/profiled/')
+        self.assertEqual(import_module.call_count, 0)
+        self.assertEqual(len(PROFILES), 2)
+
+    def test_overridden_setting(self):
+        self.assertEqual(SharkSettings.SHARK_PROFILER_HOOK, 'shark.tests.urls.profile_hook')
+        with self.settings(SHARK_PROFILER_HOOK=''):
+            self.assertEqual(SharkSettings.SHARK_PROFILER_HOOK, '')
+            self.client.get('/profiled/')
+        self.assertEqual(PROFILES, [])
+
+
+class TestPageState(SharkTestCase):
+    def test_kept_variables(self):
+        response = self.client.get('/versioned/')
+        self.assertEqual(set(load_page_state(self.page_token(response))), {'header', 'panel'})
+
+    def test_refresh_on_not_modified(self):
+        response = self.client.get('/versioned/')
+        token = self.page_token(response)
+
+        cache.delete(page_state_key(token))
+        response = self.client.get('/versioned/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertIsNotNone(load_page_state(token))
+
+
+class TestValidators(SharkTestCase):
+    def test_overridden_output_html(self):
+        response = self.client.get('/plain/')
+        self.assertContains(response, 'Plain')
+        self.assertEqual(self.client.get('/plain/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_code_version(self):
+        etag = self.client.get('/versioned/')['ETag']
+        with self.settings(SHARK_CODE_VERSION='release-2'):
+            response = self.client.get('/versioned/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get('/versioned/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class TestCommands(SharkTestCase):
+    def notify(self):
+        page_token = self.page_token(self.client.get('/action/'))
+        response = self.client.post('/action/', {'page_token': page_token, 'actions': json.dumps([['notify', {}]])})
+        return json.loads(response.content.decode())['commands']
+
+    def test_run_script(self):
+        commands = self.notify()
+        self.assertEqual([command[0] for command in commands], ['run-script', 'redirect', 'run-script', 'hide'])
+        self.assertEqual(commands[1:4:2], [['redirect', '/text/'], ['hide', '#Panel_1']])
+
+        response = self.client.get(commands[0][1])
+        self.assertEqual(response['Content-Type'], 'application/javascript')
+        self.assertEqual(response.content.decode(), 'notified();')
+        self.assertEqual(self.client.get(commands[2][1]).content.decode(), '$(".boxes").parent().show();')
+
+        cache.clear()
+        self.assertEqual(self.client.get(commands[0][1]).status_code, 404)
+
+    def test_eval_js(self):
+        with self.settings(SHARK_EVAL_JS=True):
+            self.assertEqual(self.notify()[0], ['run-js', 'notified();'])
+
+
+class TestBackgroundAction(SharkTestCase):
+    def post_commands(self, data):
+        return json.loads(self.client.post('/job/', data).content.decode())['commands']
+
+    def test_thread_executor(self):
+        executor = jobs.ThreadExecutor(1)
+        self.addCleanup(executor.shutdown)
+        # The urls of the site start with /site/, as when it's served under that path
+        set_script_prefix('/site/')
+        self.addCleanup(set_script_prefix, '/')
+        with mock.patch.object(jobs, '_executor', executor), translation.override('nl'):
+            page_token = self.page_token(self.client.get('/job/'))
+            commands = self.post_commands({'page_token': page_token, 'actions': json.dumps([['report', {}]])})
+            self.assertEqual(commands[0][0], 'poll')
+
+            job_id = commands[0][1]
+            deadline = time.time() + 5
+            while commands[-1][0] == 'poll' and time.time() < deadline:
+                time.sleep(0.01)
+                commands = self.post_commands({'job': job_id})
+
+        self.assertEqual(commands[0][:3], ['progress', job_id, 'done'])
+        self.assertIn(['replace-html', '#Panel_1', 'Done in nl at /site/job/'], commands)
+
+
+class TestPush(SharkTestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = make_page_token()
+        push.post_message(self.token, [['run-js', 'first()']])
+        # A message that took its number but isn't stored yet
+        cache.incr(push.mailbox_key(self.token))
+        push.post_message(self.token, [['run-js', 'third()']])
+
+    def test_missing_message(self):
+        self.assertEqual(push.read_messages(self.token, 0), (1, [(1, [['run-js', 'first()']])], True))
+        self.assertEqual(push.read_messages(self.token, 1), (1, [], True))
+        self.assertEqual(push.read_messages(self.token, 1, skip_missing=True),
+                         (3, [(3, [['run-js', 'third()']])], False))
+
+        cache.set(push.mailbox_key(self.token) + ':2', [['run-js', 'second()']])
+        self.assertEqual(push.read_messages(self.token, 1), (3, [(2, [['run-js', 'second()']]),
+                                                                  (3, [['run-js', 'third()']])], False))
+
+    def test_reader_skips_expired_message(self):
+        reader = push.MessageReader(self.token, 0)
+        self.assertEqual([number for number, commands in reader.read()], [1])
+        self.assertEqual(reader.read(), [])
+
+        with mock.patch.object(push, 'MISSING_TIMEOUT', 0):
+            self.assertEqual([number for number, commands in reader.read()], [3])
+        self.assertEqual(reader.after, 3)
+
+    def test_long_poll(self):
+        response = self.client.get('/push/', {'token': self.token, 'poll': 1, 'after': 0})
+        self.assertEqual(json.loads(response.content.decode()), {'after': 1, 'messages': [[['run-js', 'first()']]]})
+
+    def test_bad_request(self):
+        self.assertEqual(self.client.get('/push/', {'token': self.token, 'after': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/push/', {'token': self.token}, HTTP_LAST_EVENT_ID='x').status_code, 400)
+        self.assertEqual(self.client.get('/push/', {'token': 'x', 'poll': 1}).status_code, 404)
+
+
+class TestPageShell(SharkTestCase):
+    FULL_CONTEXT = {
+        'title': 'Title & <more>',
+        'description': 'Description "quoted"',
+        'keywords': 'shark, tests',
+        'author': 'Author',
+        'extra_meta': '        <meta name="robots" content="noindex">',
+        'extra_css': '        <link rel="stylesheet" href="/static/extra.css">\n',
+        'css': '            body { color: red; }',
+        'gtm_code': '<noscript>gtm</noscript>',
+        'modals': '<div class="modal"></div>',
+        'content': '<p>Content</p>',
+        'tail_css': '        <link rel="stylesheet" href="/static/tail.css">',
+        'extra_js': '        <script src="/static/extra.js"></script>',
+        'javascript': 'start();',
+        'page_token': 'token<&>',
+        'push_url': '/push/?token=a&b'
+    }
+
+    def assert_same_html(self, context):
+        shell = PageShell()
+        self.assertEqual(shell.page(context), render_to_string('shark/base.html', context))
+        self.assertEqual(shell.head(context), render_to_string('shark/base_head.html', context))
+        self.assertEqual(shell.tail(context), render_to_string('shark/base_tail.html', context))
+
+    def test_full_context(self):
+        self.assert_same_html(self.FULL_CONTEXT)
+
+    def test_empty_context(self):
+        self.assert_same_html({})
+
+    def test_page(self):
+        html = self.client.get('/versioned/').content
+        with mock.patch('shark.handler.page_shell', return_value=None):
+            self.assertEqual(self.client.get('/versioned/').content, html)
+
+    def test_overridden_template(self):
+        self.assertIsNotNone(page_shell())
+
+        templates = self.temp_dir()
+        os.makedirs(os.path.join(templates, 'shark'))
+        with open(os.path.join(templates, 'shark', 'base_tail.html'), 'w') as f:
+            f.write('Tail')
+        with self.settings(TEMPLATES=[{'BACKEND': 'django.template.backends.django.DjangoTemplates',
+                                       'DIRS': [templates], 'APP_DIRS': True}]):
+            self.assertIsNone(page_shell())
+
+
+class TestExport(SharkTestCase):
+    def setUp(self):
+        super().setUp()
+        self.output = self.temp_dir()
+
+    def export(self):
+        stdout = StringIO()
+        call_command('shark_export', self.output, '--no-static', '--workers', '1', stdout=stdout, stderr=StringIO())
+        with open(os.path.join(self.output, '.shark_export.json')) as f:
+            return stdout.getvalue(), json.load(f)
+
+    def test_manifest(self):
+        output, manifest = self.export()
+        self.assertTrue(manifest['/text/']['versions'])
+        self.assertTrue(manifest['/text/']['code'])
+
+        # Pages without dependencies are requested again, and not written when they reply 304
+        with mock.patch.object(shark_export, 'export_page', wraps=shark_export.export_page) as export_page:
+            output, manifest = self.export()
+        urls = [call[0][0] for call in export_page.call_args_list]
+        self.assertNotIn('/text/', urls)
+        self.assertIn('/versioned/', urls)
+        self.assertIn(' 0 written', output)
+
+        text = EditableText.objects.get(name='greeting')
+        text.content = 'Changed'
+        text.save()
+        self.export()
+        with open(shark_export.export_path(self.output, '/text/')) as f:
+            self.assertIn('Changed', f.read())
+
+    def test_changed_code(self):
+        self.export()
+        with mock.patch.object(shark_export, 'code_version', return_value='changed'), \
+                mock.patch.object(shark_export, 'export_page', wraps=shark_export.export_page) as export_page:
+            self.export()
+        self.assertIn('/text/', [call[0][0] for call in export_page.call_args_list])
+
+    def test_failed_page(self):
+        self.export()
+        with mock.patch.object(VersionedPage, 'version_key', side_effect=ValueError('Failed')), \
+                mock.patch.object(shark_export, 'code_version', return_value='changed'):
+            with self.assertRaises(CommandError):
+                self.export()
+
+        # The other pages are exported, and the page of the last export is kept
+        with open(os.path.join(self.output, '.shark_export.json')) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest['/text/']['code'], 'changed')
+        self.assertNotEqual(manifest['/versioned/']['code'], 'changed')
+        self.assertTrue(os.path.exists(shark_export.export_path(self.output, '/versioned/')))
+
+
+@modify_settings(INSTALLED_APPS={'append': 'shark.tests.testapp'})
+class TestHandlerDiscovery(SharkTestCase):
+    def test_imported_handlers(self):
+        from shark.tests.testapp.pages import AboutPage, ContactPage
+        from shark.tests.testapp.views import HomePage
+        handlers = [handler for handler in discover_handlers() if handler.__module__.startswith('shark.tests.')]
+        self.assertEqual(handlers, [AboutPage, ContactPage, HomePage])
+
+    def test_manifest(self):
+        path = os.path.join(self.temp_dir(), 'handlers.json')
+        write_handler_manifest(path)
+        self.assertEqual(load_handler_manifest(path), discover_handlers())
+
+        handlers = discover_handlers()
+        with mock.patch('shark.urls.discover_handlers', side_effect=AssertionError('Not used')):
+            self.assertEqual(get_handlers(path), handlers)
+
+    def test_stale_manifest(self):
+        from shark.tests.testapp import views
+        path = os.path.join(self.temp_dir(), 'handlers.json')
+        write_handler_manifest(path)
+
+        stat = os.stat(views.__file__)
+        self.addCleanup(os.utime, views.__file__, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.utime(views.__file__, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(load_handler_manifest(path))
+        with self.assertWarns(UserWarning):
+            self.assertEqual(get_handlers(path), discover_handlers())
+
+    @modify_settings(INSTALLED_APPS={'append': 'shark.tests.brokenapp'})
+    def test_import_error(self):
+        with self.assertRaises(ImportError):
+            discover_handlers()
+
+
+class TestReverse(SharkTestCase):
+    def setUp(self):
+        super().setUp()
+        handler._url_cache.clear()
+
+    def test_cache(self):
+        with mock.patch.object(handler, 'reverse', wraps=handler.reverse) as reverse:
+            self.assertEqual(StaticPageHandler.reverse(('about',)), '/page/about')
+            self.assertEqual(StaticPageHandler.reverse(('about',)), '/page/about')
+            self.assertEqual(reverse.call_count, 1)
+
+            # Equal arguments of another type get their own url
+            self.assertEqual(StaticPageHandler.reverse((1,)), '/page/1')
+            self.assertEqual(StaticPageHandler.reverse((True,)), '/page/True')
+            self.assertEqual(reverse.call_count, 3)
+
+            # Arguments that can't be hashed are reversed every time
+            StaticPageHandler.reverse((['about'],))
+            StaticPageHandler.reverse((['about'],))
+            self.assertEqual(reverse.call_count, 5)
+
+    def test_cache_size(self):
+        with mock.patch.object(handler, 'URL_CACHE_SIZE', 2):
+            StaticPageHandler.urls(['a', 'b', 'c'])
+        self.assertLessEqual(len(handler._url_cache), 2)
+
+    def test_changed_urlconf(self):
+        self.assertEqual(StaticPageHandler.reverse(('about',)), '/page/about')
+        with self.settings(ROOT_URLCONF='shark.tests.prefixed_urls'):
+            self.assertEqual(StaticPageHandler.reverse(('about',)), '/prefix/page/about')
+        self.assertEqual(StaticPageHandler.reverse(('about',)), '/page/about')
+
+        set_script_prefix('/site/')
+        self.addCleanup(set_script_prefix, '/')
+        self.assertEqual(StaticPageHandler.reverse(('about',)), '/site/page/about')
+
+    def test_urls(self):
+        urls = StaticPageHandler.urls(['about', ['contact'], ('home',)])
+        self.assertEqual([url.url(None) for url in urls], ['/page/about', '/page/contact', '/page/home'])
+        self.assertEqual(StaticPageHandler.urls([]), [])
+
+    def test_sitemap(self):
+        # StaticPage is served under its own url name, the urls of its pages are reversed with that name
+        StaticPage.objects.create(url_name='about', title='About')
+        response = self.client.get('/sitemap.xml')
+        self.assertContains(response, '<loc>http://testserver/page/about</loc>')
+        self.assertIn(StaticPageHandler, [key[0] for key in handler._url_cache])
+
+    def test_table_row_actions(self):
+        table = create_table([{'name': 'About', 'url_name': 'about'}, {'name': 'Contact', 'url_name': 'contact'}],
+                             ['name'], row_actions=(StaticPageHandler, 'url_name'))
+        self.assertEqual([row.url.url(None) for row in table.rows], ['/page/about', '/page/contact'])
+
+        renderer = Renderer()
+        renderer.render('', table)
+        self.assertIn('data-href="/page/contact"', renderer.html)
+
+
+class TestSiteMap(SharkTestCase):
+    def setUp(self):
+        super().setUp()
+        StaticPage.objects.create(url_name='about', title='About')
+
+    def get_locs(self, response):
+        if response.streaming:
+            content = b''.join(response.streaming_content)
+        elif response.get('Content-Encoding') == 'gzip':
+            content = gzip.decompress(response.content)
+        else:
+            content = response.content
+        return re.findall('<loc>(.*?)</loc>', content.decode())
+
+    def test_sitemap(self):
+        locs = self.get_locs(self.client.get('/sitemap.xml'))
+        self.assertIn('http://testserver/page/about', locs)
+        self.assertIn('http://testserver/text/', locs)
+        self.assertNotIn('http://testserver/sitemap.xml', locs)
+
+    def test_invalidation(self):
+        response = self.client.get('/sitemap.xml')
+        self.assertNotIn('http://testserver/page/contact', self.get_locs(response))
+
+        StaticPage.objects.create(url_name='contact', title='Contact')
+        changed = self.client.get('/sitemap.xml')
+        self.assertIn('http://testserver/page/contact', self.get_locs(changed))
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def test_not_modified(self):
+        response = self.client.get('/sitemap.xml')
+        self.assertEqual(self.client.get('/sitemap.xml', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        StaticPage.objects.create(url_name='contact', title='Contact')
+        self.assertEqual(self.client.get('/sitemap.xml', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_gzip(self):
+        locs = self.get_locs(self.client.get('/sitemap.xml'))
+        with mock.patch.object(gzip, 'compress', wraps=gzip.compress) as compress:
+            for i in range(2):
+                response = self.client.get('/sitemap.xml', HTTP_ACCEPT_ENCODING='gzip, deflate')
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                self.assertIn('Accept-Encoding', response['Vary'])
+                self.assertEqual(self.get_locs(response), locs)
+        # The second time it's sent from the cache
+        self.assertEqual(compress.call_count, 1)
+
+    def test_refused_gzip(self):
+        for accept_encoding in ('gzip;q=0, deflate', 'identity', '*;q=0'):
+            response = self.client.get('/sitemap.xml', HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertIn('Accept-Encoding', response['Vary'])
+        response = self.client.get('/sitemap.xml', HTTP_ACCEPT_ENCODING='deflate, *;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        response = self.client.get('/sitemap.xml', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_index(self):
+        locs = self.get_locs(self.client.get('/sitemap.xml'))
+        with mock.patch.object(handler, 'SITEMAP_SIZE', 3):
+            parts = self.get_locs(self.client.get('/sitemap.xml'))
+            self.assertEqual(parts, ['http://testserver/sitemap-{}.xml'.format(number)
+                                     for number in range(1, (len(locs) + 2) // 3 + 1)])
+
+            part_locs = []
+            for part in parts:
+                for encoding in ('', 'gzip'):
+                    response = self.client.get(part, HTTP_ACCEPT_ENCODING=encoding)
+                    self.assertEqual(self.client.get(part, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+                    part_locs.append(self.get_locs(response))
+            self.assertTrue(all(len(part) <= 3 for part in part_locs))
+            self.assertEqual([loc for part in part_locs[::2] for loc in part], locs)
+            self.assertEqual(part_locs[::2], part_locs[1::2])
+
+            self.assertEqual(self.client.get('/sitemap-0.xml').status_code, 404)
+            self.assertEqual(self.client.get('/sitemap-{}.xml'.format(len(parts) + 1)).status_code, 404)
+
+        # Parts don't exist when the urls fit in one sitemap
+        self.assertEqual(self.client.get('/sitemap-1.xml').status_code, 404)
@@ -0,0 +1,18 @@
+from shark.handler import BasePageHandler
+from shark.objects.text import Heading
+
+__all__ = ['AboutPage', 'ContactPage']
+
+
+class AboutPage(BasePageHandler):
+    route = '^about/$'
+
+    def render_page(self, request):
+        self += Heading('About')
+
+
+class ContactPage(BasePageHandler):
+    route = '^contact/$'
+
+    def render_page(self, request):
+        self += Heading('Contact')
@@ -0,0 +1,14 @@
+"""
+Views of an app that keeps most of its handlers in another module.
+"""
+from shark.handler import BasePageHandler
+from shark.objects.text import Heading
+
+from .pages import *
+
+
+class HomePage(BasePageHandler):
+    route = '^$'
+
+    def render_page(self, request):
+        self += Heading('Home')
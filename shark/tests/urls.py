@@ -0,0 +1,126 @@
+"""
+Handlers and urls used by the tests in test_handler.py.
+"""
+from django.conf.urls import url, include
+from django.http import HttpResponse
+from django.utils.translation import get_language
+
+from shark.actions import background, URL, JQ
+from shark.cache import CacheVary
+from shark.handler import BasePageHandler, StaticPage, SiteMap, SiteMapPart, ScriptHandler, shark_django_handler
+from shark.objects.caching import Cached
+from shark.objects.layout import Panel
+from shark.objects.text import Heading
+from shark.push import PushHandler
+
+
+class TextPage(BasePageHandler):
+    route = '^text/$'
+    cache_timeout = 60
+
+    def render_page(self, request):
+        self += Heading(self.text('greeting', 'Hello'))
+        self += Cached('fragment', lambda: Heading(self.text('fragment', 'Fragment')))
+
+
+class LanguagePage(BasePageHandler):
+    route = '^language/$'
+    cache_timeout = 60
+    cache_stale_timeout = 60
+    cache_vary = [CacheVary.language]
+
+    def render_page(self, request):
+        self += Heading('Language: {}'.format(get_language()))
+
+
+class SearchPage(BasePageHandler):
+    route = '^search/$'
+    cache_timeout = 60
+
+    def render_page(self, request):
+        self.results = Panel('Results for {}'.format(request.GET.get('q', '')))
+        self += self.results
+
+
+PROFILES = []
+
+
+def profile_hook(handler, profiler):
+    PROFILES.append(profiler)
+
+
+class ProfiledPage(BasePageHandler):
+    route = '^profiled/$'
+    profile = True
+
+    def render_page(self, request):
+        if 'fail' in request.GET:
+            raise ValueError('Failed')
+        self += Heading('Profiled')
+
+
+class VersionedPage(BasePageHandler):
+    route = '^versioned/$'
+
+    def __init__(self, *args, **kwargs):
+        # Objects can be assigned before BasePageHandler.__init__ runs
+        self.header = Heading('Versioned')
+        super().__init__(*args, **kwargs)
+
+    def version_key(self, request, *args, **kwargs):
+        return '1'
+
+    def render_page(self, request):
+        self.panel = Panel('Content')
+        self += self.header
+        self += self.panel
+
+
+class PlainPage(BasePageHandler):
+    route = '^plain/$'
+
+    def version_key(self, request, *args, **kwargs):
+        return '1'
+
+    def render_page(self, request):
+        pass
+
+    def output_html(self, args, kwargs):
+        return HttpResponse('Plain')
+
+
+class ActionPage(BasePageHandler):
+    route = '^action/$'
+
+    def render_page(self, request):
+        self.panel = Panel('Waiting')
+        self += self.panel
+
+    def notify(self, **kwargs):
+        self.add_javascript('notified();')
+        self.add_javascript(URL('/text/'))
+        self.panel.jq.hide()
+        self.add_javascript(JQ('$(".boxes").parent()').show())
+
+
+class JobPage(BasePageHandler):
+    route = '^job/$'
+
+    def render_page(self, request):
+        self.result = Panel('Waiting')
+        self += self.result
+
+    @background
+    def report(self, **kwargs):
+        self.progress(0.5, 'Halfway')
+        self.result.replace('Done in {} at {}'.format(get_language(), JobPage.url()))
+
+
+HANDLERS = [TextPage, LanguagePage, SearchPage, ProfiledPage, VersionedPage, PlainPage, ActionPage, JobPage, PushHandler,
+            SiteMap, SiteMapPart, ScriptHandler]
+
+handler_urls = [url(handler.route, shark_django_handler, {'handler': handler}, name=handler.get_unique_name())
+                for handler in HANDLERS]
+handler_urls.append(url('^page/(.*)$', shark_django_handler, {'handler': StaticPage}, name='shark_static_page'))
+
+urlpatterns = [url(r'^', include((handler_urls, 'shark'), namespace='shark'))]
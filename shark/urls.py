@@ -1,20 +1,114 @@
+import importlib.util
 import inspect
-import logging
-import traceback
+import json
+import os
+import sys
+import warnings
+from importlib import import_module
 from types import new_class
 
-import re
+from django.apps import apps
 from django.conf.urls import url
 
-from django.conf import settings
-
 from shark.common import listify
 from shark.handler import markdown_preview, BaseHandler, shark_django_handler, StaticPage, \
-    SiteMap, GoogleVerification, BingVerification, YandexVerification, shark_django_redirect_handler, Favicon, \
-    shark_django_handler_no_csrf
+    SiteMap, SiteMapPart, GoogleVerification, BingVerification, YandexVerification, shark_django_redirect_handler, \
+    Favicon, shark_django_handler_no_csrf, HandlerMeta, ScriptHandler
+from shark.push import PushHandler
 from shark.settings import SharkSettings
 
 
+def discover_handlers():
+    """
+    :return: The handlers defined in the views module of every installed app, or in its submodules, and the handlers
+             imported into it, like with from .pages import *. In the order of INSTALLED_APPS and by name within an
+             app.
+    """
+    handlers = []
+    for app_config in apps.get_app_configs():
+        module_name = app_config.name + '.views'
+        if importlib.util.find_spec(module_name) is None:
+            continue
+
+        module = import_module(module_name)
+        app_handlers = set(HandlerMeta.module_handlers(module_name))
+        # The registry doesn't know which handlers a views module imports, so its names are looked through too.
+        # Write a manifest with manage.py shark_handlers to skip this on start up.
+        app_handlers.update(value for value in vars(module).values()
+                            if inspect.isclass(value) and issubclass(value, BaseHandler))
+        handlers.extend(handler for handler in sorted(app_handlers, key=lambda handler: handler.__name__)
+                        if handler not in handlers)
+    return handlers
+
+
+def handler_name(handler):
+    return '{}:{}'.format(handler.__module__, handler.__qualname__)
+
+
+def handler_sources(handlers):
+    """
+    :return: The modification times of the views modules, of the modules the handlers are defined in and of the
+             directories with those modules, so a file added next to them is noticed too
+    """
+    module_names = {handler.__module__ for handler in handlers}
+    module_names.update(app_config.name + '.views' for app_config in apps.get_app_configs())
+    paths = set()
+    for module_name in module_names:
+        path = getattr(sys.modules.get(module_name), '__file__', None)
+        if path:
+            paths.update([path, os.path.dirname(path)])
+    return {path: os.stat(path).st_mtime_ns for path in sorted(paths)}
+
+
+def write_handler_manifest(path):
+    """
+    Writes the handlers found by discover_handlers to a json file, to be used through SHARK_HANDLER_MANIFEST.
+    """
+    handlers = discover_handlers()
+    with open(path, 'w') as f:
+        json.dump({
+            'handlers': [handler_name(handler) for handler in handlers],
+            'sources': handler_sources(handlers)
+        }, f, indent=1)
+
+
+def load_handler_manifest(path):
+    """
+    :return: The handlers in the manifest, or None if a module they were found in changed since it was written
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+
+    for source, mtime in manifest['sources'].items():
+        if not os.path.exists(source) or os.stat(source).st_mtime_ns != mtime:
+            return None
+
+    handlers = []
+    for name in manifest['handlers']:
+        module_name, qualname = name.split(':')
+        handler = import_module(module_name)
+        for part in qualname.split('.'):
+            handler = getattr(handler, part)
+        handlers.append(handler)
+    return handlers
+
+
+def get_handlers(manifest=None):
+    """
+    :param manifest: Path of the handler manifest, SHARK_HANDLER_MANIFEST by default
+    :return: The handlers listed in the manifest if there is one and it's up to date, otherwise the handlers found in
+             the installed apps
+    """
+    manifest = manifest or SharkSettings.SHARK_HANDLER_MANIFEST
+    if manifest and os.path.exists(manifest):
+        handlers = load_handler_manifest(manifest)
+        if handlers is not None:
+            return handlers
+        warnings.warn('{} is out of date, the handlers are looked up in the installed apps instead. Run '
+                      'manage.py shark_handlers to write it again.'.format(manifest))
+    return discover_handlers()
+
+
 def get_urls():
     urlpatterns = []
     redirects = []
@@ -23,8 +117,7 @@ def get_urls():
         if inspect.isclass(obj) and issubclass(obj, BaseHandler) and 'route' in dir(obj):
             if route or obj.route:
 
-                render_function = obj().render_base
-                if 'csrf_exempt' in dir(render_function) and render_function.csrf_exempt:
+                if getattr(obj.render_base, 'csrf_exempt', False):
                     render_handler = shark_django_handler_no_csrf
                 else:
                     render_handler = shark_django_handler
@@ -43,22 +136,8 @@ def get_urls():
                     for redirect_sub_route in redirect_route[0]:
                         redirects.append(url(redirect_sub_route, shark_django_redirect_handler, {'handler': obj, 'function':redirect_route[1]}))
 
-
-    apps = settings.INSTALLED_APPS
-    for app_name in apps:
-        try:
-            app = __import__(app_name + '.views').views
-        except ImportError as e:
-            if not re.match(r"No module named '{}'".format(app_name + '.views'), e.msg):
-                raise e
-        except AttributeError as e:
-            if not re.match(r"module '{}' has no attribute 'views'".format(app_name.split('.')[0]), e.args[0]):
-                raise e
-        else:
-            objs = [getattr(app, key) for key in dir(app)]
-
-            for obj in objs:
-                add_handler(obj)
+    for handler in get_handlers():
+        add_handler(handler)
 
     if SharkSettings.SHARK_PAGE_HANDLER:
         handler_parts = SharkSettings.SHARK_PAGE_HANDLER.split('.')
@@ -70,12 +149,18 @@ def get_urls():
             urlpatterns.append(url(
                     '^page/(.*)$',
                     shark_django_handler,
-                    {'handler': new_class('StaticPage', (StaticPage, page_handler))},
+                    {'handler': new_class('StaticPage', (StaticPage, page_handler), exec_body=lambda ns: ns.update(
+                        cache_timeout=SharkSettings.SHARK_STATIC_PAGE_CACHE_TIMEOUT,
+                        cache_stale_timeout=SharkSettings.SHARK_STATIC_PAGE_CACHE_STALE_TIMEOUT
+                    ))},
                     name='shark_static_page'
             ))
 
     add_handler(Favicon)
     add_handler(SiteMap)
+    add_handler(SiteMapPart)
+    add_handler(PushHandler)
+    add_handler(ScriptHandler)
 
     urlpatterns.append(url(r'^markdown_preview/$', markdown_preview, name='django_markdown_preview'))
 